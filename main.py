@@ -1,10 +1,41 @@
-from src.graph.builder import agent
+from __future__ import annotations
 
-__all__ = ["agent"]
+
+def get_agent():
+    """Return the compiled incident graph, importing it on first use."""
+    from src.graph import builder
+
+    return builder.get_agent()
+
+
+def __getattr__(name: str):
+    # Keep ``from main import agent`` working without importing the graph
+    # (LLM clients, catalog, langgraph) whenever main is merely imported.
+    if name == "agent":
+        return get_agent()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = ["agent", "get_agent"]
 
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(
-        "src.whatsapp.webhook:app", host="0.0.0.0", port=8000, reload=True
-    )
+    from src.config import APP_ENV
+
+    if APP_ENV == "prod":
+        # A single process: per-user locks, known threads and the active
+        # conversation cache live in memory, so extra workers could run
+        # one user's messages concurrently on the same checkpoint thread.
+        # "auto" selects uvloop / httptools whenever they are installed.
+        uvicorn.run(
+            "src.whatsapp.webhook:app",
+            host="0.0.0.0",
+            port=8000,
+            loop="auto",
+            http="auto",
+        )
+    else:
+        uvicorn.run(
+            "src.whatsapp.webhook:app", host="0.0.0.0", port=8000, reload=True
+        )
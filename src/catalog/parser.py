@@ -1,11 +1,14 @@
 """Parse Incidentes.xlsx into a list of IncidentTemplate objects."""
 from __future__ import annotations
 
+import os
+import re
+import unicodedata
 from collections import defaultdict
+from collections.abc import Iterator
+from functools import lru_cache
 from pathlib import Path
 
-from openpyxl import load_workbook
-
 from src.models import Category, IncidentTemplate, Severity, TicketType
 
 _SEVERITY_MAP: dict[str, Severity] = {
@@ -41,6 +44,22 @@ _CATEGORY_MAP: dict[str, Category] = {
     "reclamos de clientes": Category.REC,
 }
 
+# Display names for the catalog text given to the LLM
+_CATEGORY_NAMES: dict[Category, str] = {
+    Category.POS: "Terminales / POS",
+    Category.IMP: "Impresoras / Tickets",
+    Category.NET: "Internet / Conectividad",
+    Category.ELE: "Electricidad / Energía",
+    Category.EQU: "Equipos de Cómputo",
+    Category.INF: "Local / Infraestructura",
+    Category.MAT: "Materiales / Suministros",
+    Category.VEN: "Operación de Ventas",
+    Category.PAG: "Pagos y Premios",
+    Category.CON: "Contabilidad / Cuadres",
+    Category.FRA: "Seguridad / Fraude",
+    Category.REC: "Reclamos de Clientes",
+}
+
 _TICKET_TYPE_MAP: dict[str, TicketType] = {
     "incidente": TicketType.INCIDENTE,
     "alerta": TicketType.ALERTA,
@@ -48,31 +67,95 @@ _TICKET_TYPE_MAP: dict[str, TicketType] = {
 }
 
 
+def _fold(text: str) -> str:
+    """Lower-case *text* and drop accents so NFC/NFD/unaccented variants match."""
+    decomposed = unicodedata.normalize("NFKD", text.strip().lower())
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def _category_key(raw: str) -> str:
+    """Fold a category header and drop spaces and slashes."""
+    return _fold(raw).replace(" ", "").replace("/", "")
+
+
+# Lookup tables keyed by the folded spellings, built once at import
+_SEVERITY_LOOKUP: dict[str, Severity] = {
+    _fold(key): sev for key, sev in _SEVERITY_MAP.items()
+}
+_SEVERITY_RE = re.compile("|".join(re.escape(key) for key in _SEVERITY_LOOKUP))
+
+_CATEGORY_FOLDED: dict[str, Category] = {
+    _fold(key): cat for key, cat in _CATEGORY_MAP.items()
+}
+_CATEGORY_LOOKUP: dict[str, Category] = {
+    _category_key(key): cat for key, cat in _CATEGORY_MAP.items()
+}
+
+_TRUTHY: frozenset[str] = frozenset({"si", "yes", "true", "1"})
+
+
 def _parse_severity(raw: str) -> Severity:
-    normalized = raw.strip().lower().split("(")[0].strip()
-    for key, sev in _SEVERITY_MAP.items():
-        if key in normalized:
-            return sev
+    # Only the text before a "(...)" qualifier names the level; bound the
+    # search there instead of slicing a copy.
+    folded = _fold(raw)
+    end = folded.find("(")
+    match = _SEVERITY_RE.search(folded, 0, end if end >= 0 else len(folded))
+    if match:
+        return _SEVERITY_LOOKUP[match.group()]
     return Severity.MEDIUM
 
 
 def _resolve_category(raw: str) -> Category:
-    normalized = raw.strip().lower()
-    for key, cat in _CATEGORY_MAP.items():
-        if key in normalized:
+    cat = _CATEGORY_LOOKUP.get(_category_key(raw))
+    if cat is not None:
+        return cat
+    # Fall back to substring matching for decorated headers
+    folded = _fold(raw)
+    for key, cat in _CATEGORY_FOLDED.items():
+        if key in folded:
             return cat
     raise ValueError(f"Unknown category: {raw!r}")
 
 
 def parse_catalog(catalog_path: Path | str) -> list[IncidentTemplate]:
-    """Read the Excel catalog and return structured templates."""
-    wb = load_workbook(str(catalog_path), read_only=True, data_only=True)
-    ws = wb.active
+    """Read the Excel catalog and return structured templates.
+
+    Results are cached per path and modification time, so the workbook is
+    only re-read after it changes on disk.
+    """
+    path = str(catalog_path)
+    return list(_parse_catalog_cached(path, os.path.getmtime(path)))
+
+
+@lru_cache(maxsize=4)
+def _parse_catalog_cached(path: str, mtime: float) -> tuple[IncidentTemplate, ...]:
+    # openpyxl is only needed when the workbook is actually (re)read
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        return tuple(_parse_rows(wb.active))
+    finally:
+        wb.close()
+
+
+def _cell_text(value: object, default: str = "") -> str:
+    """Return a cell value as stripped text, or *default* when it is empty."""
+    if value is None:
+        return default
+    text = (value if isinstance(value, str) else str(value)).strip()
+    return text or default
+
+
+def _parse_rows(ws) -> Iterator[IncidentTemplate]:
+    """Yield templates from the rows of a read-only worksheet in one pass."""
+    # The sheet's stored dimensions may be stale; let openpyxl stream
+    # only the cells that actually exist, limited to columns A–G.
+    ws.reset_dimensions()
 
-    templates: list[IncidentTemplate] = []
     counters: dict[str, int] = defaultdict(int)
 
-    for row in ws.iter_rows(min_row=2, values_only=True):
+    for row in ws.iter_rows(min_row=2, max_col=7, values_only=True):
         if not row or len(row) < 7:
             continue
         cat_raw, sub_cat, ticket_type_raw, description, severity_raw, sla, requires_image = row[:7]
@@ -80,61 +163,76 @@ def parse_catalog(catalog_path: Path | str) -> list[IncidentTemplate]:
         if not cat_raw or not description:
             continue
 
-        category = _resolve_category(str(cat_raw))
+        category = _resolve_category(_cell_text(cat_raw))
         counters[category.value] += 1
         code = f"{category.value}-{counters[category.value]:03d}"
 
         ticket_type = _TICKET_TYPE_MAP.get(
-            str(ticket_type_raw or "").strip().lower(),
+            _cell_text(ticket_type_raw).lower(),
             TicketType.INCIDENTE,
         )
 
-        templates.append(IncidentTemplate(
+        # Every field is already coerced to its final type here, so skip
+        # pydantic validation and build the model directly.
+        name = _cell_text(description)
+        yield IncidentTemplate.model_construct(
             code=code,
             category=category,
-            sub_category=str(sub_cat or "").strip(),
-            name=str(description).strip(),
-            description=str(description).strip(),
-            severity=_parse_severity(str(severity_raw or "Media")),
+            sub_category=_cell_text(sub_cat),
+            name=name,
+            description=name,
+            severity=_parse_severity(_cell_text(severity_raw, "Media")),
             ticket_type=ticket_type,
-            sla=str(sla or "").strip(),
-            requires_image=bool(requires_image and str(requires_image).strip().lower() in ("sí", "si", "yes", "true", "1")),
-        ))
+            sla=_cell_text(sla),
+            requires_image=_fold(_cell_text(requires_image)) in _TRUTHY,
+        )
 
-    wb.close()
-    return templates
+
+# One catalog entry per template, formatted in a single pass (the trailing
+# newline leaves a blank line between entries once joined)
+_CATALOG_ENTRY_FMT = (
+    "### %s – %s\n"
+    "- **Subcategoría:** %s\n"
+    "- **Tipo de ticket:** %s\n"
+    "- **Severidad:** %s\n"
+    "- **SLA:** %s\n"
+)
 
 
 def load_catalog_text(catalog_path: Path | str) -> str:
     """Return a readable text version of the Excel catalog for LLM prompts."""
-    templates = parse_catalog(catalog_path)
+    path = str(catalog_path)
+    return _load_catalog_text_cached(path, os.path.getmtime(path))
+
+
+@lru_cache(maxsize=4)
+def _load_catalog_text_cached(path: str, mtime: float) -> str:
+    templates = _parse_catalog_cached(path, mtime)
     lines: list[str] = ["# Catálogo de Incidentes — Agencias de Lotería\n"]
 
     current_cat = None
     for t in templates:
         if t.category != current_cat:
             current_cat = t.category
-            cat_names = {
-                Category.POS: "Terminales / POS",
-                Category.IMP: "Impresoras / Tickets",
-                Category.NET: "Internet / Conectividad",
-                Category.ELE: "Electricidad / Energía",
-                Category.EQU: "Equipos de Cómputo",
-                Category.INF: "Local / Infraestructura",
-                Category.MAT: "Materiales / Suministros",
-                Category.VEN: "Operación de Ventas",
-                Category.PAG: "Pagos y Premios",
-                Category.CON: "Contabilidad / Cuadres",
-                Category.FRA: "Seguridad / Fraude",
-                Category.REC: "Reclamos de Clientes",
-            }
-            lines.append(f"\n## {cat_names.get(current_cat, current_cat.value)}\n")
-
-        lines.append(f"### {t.code} – {t.name}")
-        lines.append(f"- **Subcategoría:** {t.sub_category}")
-        lines.append(f"- **Tipo de ticket:** {t.ticket_type.value}")
-        lines.append(f"- **Severidad:** {t.severity.value}")
-        lines.append(f"- **SLA:** {t.sla}")
-        lines.append("")
+            lines.append(f"\n## {_CATEGORY_NAMES.get(current_cat, current_cat.value)}\n")
+
+        lines.append(_CATALOG_ENTRY_FMT % (
+            t.code, t.name, t.sub_category, t.ticket_type.value, t.severity.value, t.sla,
+        ))
 
     return "\n".join(lines)
+
+
+def load_catalog_all(
+    catalog_path: Path | str,
+) -> tuple[str, list[IncidentTemplate], dict[str, IncidentTemplate]]:
+    """Return ``(text, templates, by_code)`` for the catalog from one stat and read.
+
+    The prompt text is derived from the same cached templates, so callers
+    that need both no longer resolve the workbook twice.
+    """
+    path = str(catalog_path)
+    mtime = os.path.getmtime(path)
+    templates = list(_parse_catalog_cached(path, mtime))
+    text = _load_catalog_text_cached(path, mtime)
+    return text, templates, {t.code: t for t in templates}
@@ -29,6 +29,9 @@ MEDIA_DIR = DATA_DIR / "media"
 VISION_MODEL: str = os.getenv("VISION_MODEL", "gpt-4o")
 WHISPER_MODEL: str = os.getenv("WHISPER_MODEL", "whisper-1")
 
+# ── Server ───────────────────────────────────────────────────────────
+APP_ENV: str = os.getenv("APP_ENV", "dev")
+
 # ── Ensure runtime dirs exist ──────────────────────────────────────────
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 (DATA_DIR / "checkpoints").mkdir(parents=True, exist_ok=True)
@@ -7,23 +7,45 @@ from __future__ import annotations
 
 import json
 import logging
+import threading
 from dataclasses import dataclass
+from typing import TYPE_CHECKING
 
 from langchain_core.messages import HumanMessage
-from langchain_openai import ChatOpenAI
 
 from src.config import MODEL_NAME, MODEL_TEMPERATURE
 from src.prompts.loader import render
 
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
+
 logger = logging.getLogger(__name__)
 
 _safety_llm: ChatOpenAI | None = None
+_safety_llm_lock = threading.Lock()
+
+_MEDIA_DESC_FMT = "[Descripción de media adjunta: %s]"
+
+# content_safety.j2 has a single slot, so it is rendered once and the
+# evaluated content is spliced between the static halves on each call.
+_CONTENT_SLOT = "\x00content\x00"
+_safety_prefix, _safety_suffix = render(
+    "content_safety.j2", content=_CONTENT_SLOT
+).split(_CONTENT_SLOT)
 
 
 def _get_safety_llm() -> ChatOpenAI:
     global _safety_llm
     if _safety_llm is None:
-        _safety_llm = ChatOpenAI(model=MODEL_NAME, temperature=0)
+        with _safety_llm_lock:
+            if _safety_llm is None:
+                from langchain_openai import ChatOpenAI
+
+                _safety_llm = ChatOpenAI(
+                    model=MODEL_NAME,
+                    temperature=0,
+                    model_kwargs={"response_format": {"type": "json_object"}},
+                )
     return _safety_llm
 
 
@@ -47,23 +69,20 @@ def check_content_safety(
     Returns:
         ContentSafetyResult with is_safe=True if content can proceed, False otherwise.
     """
-    # Build the full content string to evaluate
-    parts = [text] if text else []
-    for desc in media_descriptions or []:
-        if desc:
-            parts.append(f"[Descripción de media adjunta: {desc}]")
-
-    content = "\n".join(parts).strip()
+    # Build the full content string to evaluate in a single join
+    media = [_MEDIA_DESC_FMT % desc for desc in media_descriptions or () if desc]
+    content = "\n".join([text, *media] if text else media).strip()
 
     if not content:
         # Empty content is safe — the classifier will handle it
         return ContentSafetyResult(is_safe=True, reason="Contenido vacío")
 
-    prompt = render("content_safety.j2", content=content)
+    prompt = _safety_prefix + content + _safety_suffix
 
     try:
-        resp = _get_safety_llm().invoke([HumanMessage(content=prompt)])
-        data = json.loads(resp.content.strip())
+        llm = _get_safety_llm()
+        resp = llm.invoke((HumanMessage(content=prompt),))
+        data = json.loads(resp.content)
         verdict = data.get("verdict", "SAFE").upper()
         reason = data.get("reason", "")
     except (json.JSONDecodeError, AttributeError, Exception) as e:
@@ -1,7 +1,12 @@
 """SQLite connection and table creation."""
 from __future__ import annotations
 
+import re
 import sqlite3
+import threading
+from collections import OrderedDict
+from collections.abc import Iterator
+from contextlib import contextmanager
 from pathlib import Path
 
 from src.config import DB_PATH
@@ -69,19 +74,183 @@ CREATE TABLE IF NOT EXISTS incident_attachments (
     description   TEXT,
     created_at    TEXT NOT NULL DEFAULT (datetime('now','localtime'))
 );
+
+-- Accepted LLM classifications, keyed by catalog version + description
+CREATE TABLE IF NOT EXISTS classify_cache (
+    key        TEXT PRIMARY KEY,
+    candidate  TEXT NOT NULL,
+    created_at TEXT NOT NULL DEFAULT (datetime('now','localtime'))
+);
+
+CREATE INDEX IF NOT EXISTS ix_incidents_reported_by_dt
+    ON incidents(reported_by, date_time_reported DESC);
+
+CREATE INDEX IF NOT EXISTS ix_conversations_thread_status
+    ON conversations(thread_id, status, started_at DESC);
+
+-- Foreign-key check when incidents are deleted (delete_by_user)
+CREATE INDEX IF NOT EXISTS ix_conversations_incident
+    ON conversations(incident_id);
+
+CREATE INDEX IF NOT EXISTS ix_conversation_log_thread
+    ON conversation_log(thread_id, id);
+
+CREATE INDEX IF NOT EXISTS ix_attachments_incident
+    ON incident_attachments(incident_id, id);
 """
 
 
+# Every table and index declared above; init_db skips the DDL when all exist
+_SCHEMA_OBJECTS = frozenset(
+    re.findall(r"CREATE (?:TABLE|INDEX) IF NOT EXISTS (\w+)", _DDL)
+)
+
+
+class ActiveConversationCache:
+    """Per-connection map of thread_id → active conversation.
+
+    ConversationRepository fills it on create/get_active, keeps the cached
+    message counter in step with increment_messages and drops entries on
+    finish. Only writes made through the owning connection are seen, so
+    conversations must be created and finished through the same connection
+    (the adapter's thread connection). Least recently used threads are
+    evicted past *maxsize*.
+    """
+
+    def __init__(self, maxsize: int = 1024) -> None:
+        self.maxsize = maxsize
+        self._by_thread: OrderedDict[str, object] = OrderedDict()
+        self._thread_of: dict[str, str] = {}
+
+    def get(self, thread_id: str) -> object | None:
+        value = self._by_thread.get(thread_id)
+        if value is not None:
+            self._by_thread.move_to_end(thread_id)
+        return value
+
+    def get_by_id(self, conversation_id: str) -> object | None:
+        thread_id = self._thread_of.get(conversation_id)
+        return None if thread_id is None else self._by_thread.get(thread_id)
+
+    def put(self, thread_id: str, value) -> None:
+        old = self._by_thread.pop(thread_id, None)
+        if old is not None:
+            self._thread_of.pop(old.id, None)
+        self._by_thread[thread_id] = value
+        self._thread_of[value.id] = thread_id
+        if len(self._by_thread) > self.maxsize:
+            _, evicted = self._by_thread.popitem(last=False)
+            self._thread_of.pop(evicted.id, None)
+
+    def discard(self, conversation_id: str) -> None:
+        thread_id = self._thread_of.pop(conversation_id, None)
+        if thread_id is not None:
+            self._by_thread.pop(thread_id, None)
+
+
+class Connection(sqlite3.Connection):
+    """sqlite3 connection that carries the active-conversation cache."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.active_conversations = ActiveConversationCache()
+
+
+def apply_pragmas(conn: sqlite3.Connection) -> None:
+    """Apply the WAL / durability / cache PRAGMAs shared by every DB connection.
+
+    With WAL, synchronous=NORMAL only fsyncs at checkpoint time: a commit
+    stays consistent after an application crash, but the last transactions
+    may be lost on an OS crash or power failure. That is acceptable for chat
+    logs and checkpoints.
+    """
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA cache_size=-64000")
+
+
 def get_connection(db_path: Path | str | None = None) -> sqlite3.Connection:
+    """Open an app DB connection in autocommit mode.
+
+    With ``isolation_level=None`` the driver never opens implicit
+    transactions: a lone statement commits by itself and multi-statement
+    work is grouped explicitly with ``transaction()``.
+    """
     path = str(db_path or DB_PATH)
-    conn = sqlite3.connect(path, timeout=10)
+    conn = sqlite3.connect(
+        path,
+        timeout=10,
+        cached_statements=256,
+        isolation_level=None,
+        factory=Connection,
+    )
     conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL")
-    conn.execute("PRAGMA busy_timeout=5000")
+    apply_pragmas(conn)
     conn.execute("PRAGMA foreign_keys=ON")
     return conn
 
 
+_local = threading.local()
+
+
+def get_thread_connection() -> sqlite3.Connection:
+    """Return this thread's persistent connection to the app DB.
+
+    The connection is opened on first use and reused afterwards, so callers
+    must not close it. This is the app's connection pool: the event loop
+    thread and each graph worker thread hold one connection apiece, and it
+    is released when its thread exits.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = get_connection()
+        _local.conn = conn
+    return conn
+
+
+@contextmanager
+def transaction(
+    conn: sqlite3.Connection, immediate: bool = False
+) -> Iterator[sqlite3.Connection]:
+    """Group repository writes on *conn* into a single BEGIN…COMMIT.
+
+    Repository methods called inside the block skip their own commit; the
+    whole batch is committed on exit or rolled back on error. Nested blocks
+    join the outermost transaction. With *immediate*, the write lock is
+    taken up front (BEGIN IMMEDIATE) instead of being upgraded mid-way.
+    """
+    batched = _local.__dict__.setdefault("batched", set())
+    key = id(conn)
+    if key in batched:
+        yield conn
+        return
+
+    batched.add(key)
+    try:
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+    finally:
+        batched.discard(key)
+
+
+def commit(conn: sqlite3.Connection) -> None:
+    """Commit *conn* unless an enclosing transaction() will do it.
+
+    A no-op for autocommit connections outside an explicit transaction.
+    """
+    if conn.in_transaction and id(conn) not in getattr(_local, "batched", ()):
+        conn.commit()
+
+
 def _migrate(conn: sqlite3.Connection) -> None:
     """Apply lightweight migrations for existing databases."""
     # Add conversation_id column to conversation_log if missing
@@ -96,8 +265,52 @@ def _migrate(conn: sqlite3.Connection) -> None:
         conn.commit()
 
 
+# Bumped whenever init_db gains a one-time data migration (PRAGMA user_version)
+_SCHEMA_VERSION = 1
+
+# Columns once written from Python as isoformat() ("YYYY-MM-DDTHH:MM:SS.ffffff")
+_TIMESTAMP_COLUMNS: tuple[tuple[str, str], ...] = (
+    ("users", "created_at"),
+    ("users", "updated_at"),
+    ("incidents", "date_time_reported"),
+    ("incidents", "closed_at"),
+    ("incidents", "created_at"),
+    ("conversations", "started_at"),
+    ("conversations", "ended_at"),
+)
+
+
+def _normalize_timestamps(conn: sqlite3.Connection) -> None:
+    """Rewrite legacy ISO timestamps as "YYYY-MM-DD HH:MM:SS".
+
+    Text ordering only works within one format (" " sorts before "T"), so
+    old rows would otherwise sort above newer ones in ORDER BY ... DESC.
+    """
+    with transaction(conn):
+        for table, col in _TIMESTAMP_COLUMNS:
+            conn.execute(
+                f"UPDATE {table} SET {col} = replace(substr({col}, 1, 19), 'T', ' ') "
+                f"WHERE {col} LIKE '____-__-__T%'"
+            )
+
+
 def init_db(db_path: Path | str | None = None) -> None:
     conn = get_connection(db_path)
-    conn.executescript(_DDL)
-    _migrate(conn)
+    existing = {
+        row[0]
+        for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type IN ('table', 'index')"
+        )
+    }
+    if not _SCHEMA_OBJECTS <= existing:
+        conn.executescript(_DDL)
+        # Refresh planner statistics so the indexes above are picked up
+        conn.execute("ANALYZE")
+    # Freshly created tables already have the latest columns
+    if "conversation_log" in existing:
+        _migrate(conn)
+    # Data migrations run once per database, whether or not the DDL ran
+    if conn.execute("PRAGMA user_version").fetchone()[0] < _SCHEMA_VERSION:
+        _normalize_timestamps(conn)
+        conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
     conn.close()
@@ -1,19 +1,206 @@
-"""CRUD repositories for users, incidents, conversation log, and conversations."""
+"""CRUD repositories for users, incidents, conversation log, conversations
+and the classification cache."""
 from __future__ import annotations
 
+import json
 import sqlite3
 import uuid
+from collections.abc import Iterable, Iterator
 from datetime import datetime
 from typing import Optional
 
+from src.db.engine import commit, transaction
 from src.models import (
     Conversation,
     ConversationStatus,
     IncidentRecord,
+    IncidentRow,
     IncidentStatus,
     UserProfile,
 )
 
+# Statement text lives at module level: sqlite3 caches prepared statements
+# keyed on the SQL string, so every call reuses the same compiled statement
+# without rebuilding the text. Keep these static (no per-call f-strings).
+# created_at / updated_at come from the schema defaults.
+_UPSERT_USER_SQL = """
+INSERT INTO users (phone_number, name, area, shift, role)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT(phone_number) DO UPDATE SET
+  name=excluded.name, area=excluded.area, shift=excluded.shift,
+  role=excluded.role, updated_at=datetime('now','localtime')
+"""
+
+_ENSURE_USER_SQL = "INSERT OR IGNORE INTO users (phone_number, name) VALUES (?, '')"
+
+_INSERT_INCIDENT_SQL = """
+INSERT INTO incidents
+  (incident_code, incident_name, category, sub_category, severity,
+   ticket_type, sla, date_time_reported, reported_by, agency,
+   shift, description, status, root_cause, corrective_action,
+   preventive_action, closed_by, closed_at)
+VALUES (?,?,?,?,?,?,?,COALESCE(?, datetime('now','localtime')),?,?,?,?,?,?,?,?,?,?)
+RETURNING id
+"""
+
+_INSERT_ATTACHMENT_SQL = """
+INSERT INTO incident_attachments
+  (incident_id, file_path, media_type, original_name, description)
+VALUES (?, ?, ?, ?, ?)
+"""
+
+_INSERT_ATTACHMENT_RETURNING_SQL = _INSERT_ATTACHMENT_SQL + "RETURNING id\n"
+
+# Explicit column lists so reads don't silently widen with the schema
+_USER_COLS = "phone_number, name, area, shift, role, created_at, updated_at"
+_RECENT_INCIDENT_COLS = (
+    "id, incident_code, incident_name, category, severity, status, date_time_reported"
+)
+_ATTACHMENT_COLS = (
+    "id, incident_id, file_path, media_type, original_name, description, created_at"
+)
+_LOG_COLS = "id, thread_id, role, content, conversation_id, created_at"
+_CONVERSATION_COLS = (
+    "id, thread_id, started_at, ended_at, status, outcome, incident_id, total_messages"
+)
+
+_SELECT_USER_SQL = f"SELECT {_USER_COLS} FROM users WHERE phone_number = ?"
+
+_SELECT_RECENT_INCIDENTS_SQL = f"""
+SELECT {_RECENT_INCIDENT_COLS} FROM incidents
+WHERE reported_by = ?
+ORDER BY date_time_reported DESC
+LIMIT ?
+"""
+
+_SELECT_ATTACHMENTS_SQL = (
+    f"SELECT {_ATTACHMENT_COLS} FROM incident_attachments WHERE incident_id = ? ORDER BY id"
+)
+
+# Chat hot path: every message appends to the log and bumps its counter
+_APPEND_LOG_SQL = (
+    "INSERT INTO conversation_log (thread_id, role, content, conversation_id) "
+    "VALUES (?, ?, ?, ?)"
+)
+
+_SELECT_THREAD_LOG_SQL = (
+    f"SELECT {_LOG_COLS} FROM conversation_log WHERE thread_id = ? ORDER BY id"
+)
+
+_INSERT_CONVERSATION_SQL = """
+INSERT INTO conversations (id, thread_id, started_at, status, outcome, total_messages)
+VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+_SELECT_ACTIVE_CONVERSATION_SQL = f"""
+SELECT {_CONVERSATION_COLS} FROM conversations
+WHERE thread_id = ? AND status = 'ACTIVE'
+ORDER BY started_at DESC
+LIMIT 1
+"""
+
+_FINISH_CONVERSATION_SQL = """
+UPDATE conversations
+SET ended_at = datetime('now','localtime'), status = ?, outcome = ?,
+    incident_id = COALESCE(?, incident_id)
+WHERE id = ?
+"""
+
+_INCREMENT_MESSAGES_SQL = (
+    "UPDATE conversations SET total_messages = total_messages + ? WHERE id = ?"
+)
+
+# Classify cache rows younger than the max age (bound as "-N days")
+_SELECT_CLASSIFY_CACHE_SQL = """
+SELECT candidate FROM classify_cache
+WHERE key = ? AND created_at >= datetime('now','localtime', ?)
+"""
+
+# Drops expired rows and everything past the newest max_rows
+_PRUNE_CLASSIFY_CACHE_SQL = """
+DELETE FROM classify_cache
+WHERE created_at < datetime('now','localtime', ?)
+   OR key NOT IN (
+       SELECT key FROM classify_cache ORDER BY created_at DESC, rowid DESC LIMIT ?
+   )
+"""
+
+
+def _timestamp(dt: datetime) -> str:
+    """Format *dt* like the schema's ``datetime('now','localtime')`` defaults.
+
+    One fixed-width format keeps TEXT ordering on timestamp columns
+    chronological whether a value came from Python or from SQLite.
+    """
+    return dt.isoformat(sep=" ", timespec="seconds")
+
+
+def _row_to_user(row: sqlite3.Row) -> UserProfile:
+    """Build a UserProfile from a ``_USER_COLS`` row without re-validating it."""
+    phone_number, name, area, shift, role, created_at, updated_at = row
+    return UserProfile.model_construct(
+        phone_number=phone_number,
+        name=name or "",
+        area=area or "",
+        shift=shift or "",
+        role=role or "",
+        created_at=datetime.fromisoformat(created_at),
+        updated_at=datetime.fromisoformat(updated_at),
+    )
+
+
+def _row_to_conversation(row: sqlite3.Row) -> Conversation:
+    """Build a Conversation from a ``_CONVERSATION_COLS`` row without re-validating it."""
+    (
+        conv_id, thread_id, started_at, ended_at,
+        status, outcome, incident_id, total_messages,
+    ) = row
+    return Conversation.model_construct(
+        id=conv_id,
+        thread_id=thread_id,
+        started_at=datetime.fromisoformat(started_at),
+        ended_at=datetime.fromisoformat(ended_at) if ended_at else None,
+        status=ConversationStatus(status),
+        outcome=outcome or "",
+        incident_id=incident_id,
+        total_messages=total_messages or 0,
+    )
+
+
+def _user_params(profile: UserProfile) -> tuple:
+    """Positional parameters for ``_UPSERT_USER_SQL``."""
+    return (
+        profile.phone_number,
+        profile.name,
+        profile.area,
+        profile.shift,
+        profile.role,
+    )
+
+
+def _incident_params(record: IncidentRecord | IncidentRow) -> tuple:
+    """Positional parameters for ``_INSERT_INCIDENT_SQL``."""
+    return (
+        record.incident_code,
+        record.incident_name,
+        record.category.value,
+        record.sub_category,
+        record.severity.value,
+        record.ticket_type.value,
+        record.sla,
+        _timestamp(record.date_time_reported) if record.date_time_reported else None,
+        record.reported_by,
+        record.agency,
+        record.shift,
+        record.description,
+        record.status.value,
+        record.root_cause,
+        record.corrective_action,
+        record.preventive_action,
+        record.closed_by,
+        _timestamp(record.closed_at) if record.closed_at else None,
+    )
+
 
 class UserRepository:
     def __init__(self, conn: sqlite3.Connection) -> None:
@@ -21,100 +208,63 @@ class UserRepository:
 
     def get(self, phone_number: str) -> Optional[UserProfile]:
         row = self.conn.execute(
-            "SELECT * FROM users WHERE phone_number = ?", (phone_number,)
+            _SELECT_USER_SQL, (phone_number,)
         ).fetchone()
         if row is None:
             return None
-        return UserProfile(**dict(row))
+        return _row_to_user(row)
 
     def delete(self, phone_number: str) -> bool:
         """Delete a user by phone number. Returns True if a row was deleted."""
         cur = self.conn.execute(
             "DELETE FROM users WHERE phone_number = ?", (phone_number,)
         )
-        self.conn.commit()
+        commit(self.conn)
         return cur.rowcount > 0
 
     def ensure_exists(self, phone_number: str) -> None:
         """Create a minimal user record if one doesn't exist yet."""
-        self.conn.execute(
-            """INSERT OR IGNORE INTO users (phone_number, name, created_at, updated_at)
-               VALUES (?, '', ?, ?)
-            """,
-            (phone_number, datetime.now().isoformat(), datetime.now().isoformat()),
-        )
-        self.conn.commit()
+        self.conn.execute(_ENSURE_USER_SQL, (phone_number,))
+        commit(self.conn)
 
     def upsert(self, profile: UserProfile) -> None:
-        self.conn.execute(
-            """INSERT INTO users (phone_number, name, area, shift, role, created_at, updated_at)
-               VALUES (?, ?, ?, ?, ?, ?, ?)
-               ON CONFLICT(phone_number) DO UPDATE SET
-                 name=excluded.name, area=excluded.area, shift=excluded.shift,
-                 role=excluded.role, updated_at=excluded.updated_at
-            """,
-            (
-                profile.phone_number,
-                profile.name,
-                profile.area,
-                profile.shift,
-                profile.role,
-                profile.created_at.isoformat(),
-                datetime.now().isoformat(),
-            ),
-        )
-        self.conn.commit()
+        self.conn.execute(_UPSERT_USER_SQL, _user_params(profile))
+        commit(self.conn)
 
 
 class IncidentRepository:
     def __init__(self, conn: sqlite3.Connection) -> None:
         self.conn = conn
 
-    def save(self, record: IncidentRecord) -> int:
-        cur = self.conn.execute(
-            """INSERT INTO incidents
-               (incident_code, incident_name, category, sub_category, severity,
-                ticket_type, sla, date_time_reported, reported_by, agency,
-                shift, description, status, root_cause, corrective_action,
-                preventive_action, closed_by, closed_at, created_at)
-               VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-            """,
-            (
-                record.incident_code,
-                record.incident_name,
-                record.category.value,
-                record.sub_category,
-                record.severity.value,
-                record.ticket_type.value,
-                record.sla,
-                record.date_time_reported.isoformat(),
-                record.reported_by,
-                record.agency,
-                record.shift,
-                record.description,
-                record.status.value,
-                record.root_cause,
-                record.corrective_action,
-                record.preventive_action,
-                record.closed_by,
-                record.closed_at.isoformat() if record.closed_at else None,
-                record.created_at.isoformat(),
-            ),
-        )
-        self.conn.commit()
-        return cur.lastrowid  # type: ignore[return-value]
+    def save(self, record: IncidentRecord | IncidentRow) -> int:
+        return self.save_many((record,))[0]
+
+    def save_many(
+        self, records: Iterable[IncidentRecord | IncidentRow]
+    ) -> list[int]:
+        """Insert several incidents with a single commit; returns their ids in order.
+
+        Parameters come from ``_incident_params``, which resolves the enum
+        values once per record.
+        """
+        execute = self.conn.execute
+        with transaction(self.conn):
+            return [
+                execute(_INSERT_INCIDENT_SQL, _incident_params(record)).fetchone()[0]
+                for record in records
+            ]
 
     def get_recent_by_user(
         self, phone_number: str, limit: int = 5
-    ) -> list[dict]:
-        rows = self.conn.execute(
-            """SELECT * FROM incidents
-               WHERE reported_by = ?
-               ORDER BY date_time_reported DESC
-               LIMIT ?""",
-            (phone_number, limit),
+    ) -> list[sqlite3.Row]:
+        """Return summary columns of the user's most recent incidents.
+
+        Rows support ``row["col"]`` access; convert with ``dict(row)`` only
+        where a real dict is needed.
+        """
+        return self.conn.execute(
+            _SELECT_RECENT_INCIDENTS_SQL, (phone_number, limit)
         ).fetchall()
-        return [dict(r) for r in rows]
 
     def update_status(
         self, incident_id: int, status: IncidentStatus
@@ -123,20 +273,33 @@ class IncidentRepository:
             "UPDATE incidents SET status = ? WHERE id = ?",
             (status.value, incident_id),
         )
-        self.conn.commit()
+        commit(self.conn)
 
     def delete_by_user(self, phone_number: str) -> int:
-        """Delete all incidents (and their attachments) for a user. Returns count deleted."""
-        # Delete attachments for this user's incidents first
-        self.conn.execute(
-            """DELETE FROM incident_attachments
-               WHERE incident_id IN (SELECT id FROM incidents WHERE reported_by = ?)""",
-            (phone_number,),
-        )
-        cur = self.conn.execute(
-            "DELETE FROM incidents WHERE reported_by = ?", (phone_number,)
-        )
-        self.conn.commit()
+        """Delete all incidents (and their attachments) for a user. Returns count deleted.
+
+        Conversations that point at the incidents are detached (incident_id
+        set to NULL): ``conversations.incident_id`` references ``incidents``
+        and conversations outlive ``/borrar``, so the delete would otherwise
+        fail the foreign key. Everything runs in one write transaction, so a
+        failure never leaves orphaned attachments behind.
+        """
+        with transaction(self.conn, immediate=True):
+            # Detach conversations and delete attachments that reference
+            # this user's incidents first
+            self.conn.execute(
+                """UPDATE conversations SET incident_id = NULL
+                   WHERE incident_id IN (SELECT id FROM incidents WHERE reported_by = ?)""",
+                (phone_number,),
+            )
+            self.conn.execute(
+                """DELETE FROM incident_attachments
+                   WHERE incident_id IN (SELECT id FROM incidents WHERE reported_by = ?)""",
+                (phone_number,),
+            )
+            cur = self.conn.execute(
+                "DELETE FROM incidents WHERE reported_by = ?", (phone_number,)
+            )
         return cur.rowcount
 
 
@@ -152,21 +315,35 @@ class AttachmentRepository:
         original_name: str | None = None,
         description: str | None = None,
     ) -> int:
-        cur = self.conn.execute(
-            """INSERT INTO incident_attachments
-               (incident_id, file_path, media_type, original_name, description)
-               VALUES (?, ?, ?, ?, ?)""",
+        """Insert one attachment and return its id. Use ``save_many`` for batches."""
+        attachment_id = self.conn.execute(
+            _INSERT_ATTACHMENT_RETURNING_SQL,
             (incident_id, file_path, media_type, original_name, description),
-        )
-        self.conn.commit()
-        return cur.lastrowid  # type: ignore[return-value]
+        ).fetchone()[0]
+        commit(self.conn)
+        return attachment_id
+
+    def save_many(
+        self,
+        incident_id: int,
+        attachments: Iterable[tuple[str, str, str | None, str | None]],
+    ) -> int:
+        """Insert (file_path, media_type, original_name, description) rows in one transaction.
 
-    def get_by_incident(self, incident_id: int) -> list[dict]:
-        rows = self.conn.execute(
-            "SELECT * FROM incident_attachments WHERE incident_id = ? ORDER BY id",
-            (incident_id,),
+        Prefer this over calling ``save`` in a loop: the whole batch costs a
+        single commit. Returns the number of rows inserted.
+        """
+        with transaction(self.conn):
+            cur = self.conn.executemany(
+                _INSERT_ATTACHMENT_SQL,
+                ((incident_id, *att) for att in attachments),
+            )
+        return cur.rowcount
+
+    def get_by_incident(self, incident_id: int) -> list[sqlite3.Row]:
+        return self.conn.execute(
+            _SELECT_ATTACHMENTS_SQL, (incident_id,)
         ).fetchall()
-        return [dict(r) for r in rows]
 
 
 class ConversationLogRepository:
@@ -180,25 +357,43 @@ class ConversationLogRepository:
         content: str,
         conversation_id: Optional[str] = None,
     ) -> None:
+        """Insert one log row without an explicit commit.
+
+        On autocommit connections (``get_connection``) a lone call commits by
+        itself; batch several inside ``transaction()`` or use ``append_many``.
+        """
         self.conn.execute(
-            "INSERT INTO conversation_log (thread_id, role, content, conversation_id) VALUES (?, ?, ?, ?)",
+            _APPEND_LOG_SQL,
             (thread_id, role, content, conversation_id),
         )
-        self.conn.commit()
 
-    def get_thread(self, thread_id: str) -> list[dict]:
-        rows = self.conn.execute(
-            "SELECT * FROM conversation_log WHERE thread_id = ? ORDER BY id",
-            (thread_id,),
-        ).fetchall()
-        return [dict(r) for r in rows]
+    def append_many(
+        self, rows: Iterable[tuple[str, str, str, Optional[str]]]
+    ) -> int:
+        """Insert several (thread_id, role, content, conversation_id) rows at once.
+
+        *rows* may be any iterable (e.g. a generator over an export being
+        replayed); it is streamed into a single commit. Returns the number
+        of rows inserted.
+        """
+        # Autocommit connections would otherwise commit every row
+        with transaction(self.conn):
+            cur = self.conn.executemany(_APPEND_LOG_SQL, rows)
+        return cur.rowcount
+
+    def iter_thread(self, thread_id: str) -> Iterator[sqlite3.Row]:
+        """Yield a thread's log rows in order without loading them all."""
+        yield from self.conn.execute(_SELECT_THREAD_LOG_SQL, (thread_id,))
+
+    def get_thread(self, thread_id: str) -> list[sqlite3.Row]:
+        return list(self.iter_thread(thread_id))
 
     def delete_thread(self, thread_id: str) -> None:
         """Delete all conversation log entries for a thread."""
         self.conn.execute(
             "DELETE FROM conversation_log WHERE thread_id = ?", (thread_id,)
         )
-        self.conn.commit()
+        commit(self.conn)
 
 
 class ConversationRepository:
@@ -209,29 +404,42 @@ class ConversationRepository:
         """Create a new conversation session and return it."""
         conv = Conversation(id=str(uuid.uuid4()), thread_id=thread_id)
         self.conn.execute(
-            """INSERT INTO conversations (id, thread_id, started_at, status, outcome, total_messages)
-               VALUES (?, ?, ?, ?, ?, ?)""",
+            _INSERT_CONVERSATION_SQL,
             (
                 conv.id,
                 conv.thread_id,
-                conv.started_at.isoformat(),
+                _timestamp(conv.started_at),
                 conv.status.value,
                 conv.outcome,
                 conv.total_messages,
             ),
         )
-        self.conn.commit()
+        commit(self.conn)
+        cache = getattr(self.conn, "active_conversations", None)
+        if cache is not None:
+            cache.put(thread_id, conv)
         return conv
 
     def get_active(self, thread_id: str) -> Optional[Conversation]:
-        """Return the active conversation for a thread, if any."""
+        """Return the active conversation for a thread, if any.
+
+        Served from the connection's ActiveConversationCache when possible.
+        """
+        cache = getattr(self.conn, "active_conversations", None)
+        if cache is not None:
+            conv = cache.get(thread_id)
+            if conv is not None:
+                return conv
         row = self.conn.execute(
-            "SELECT * FROM conversations WHERE thread_id = ? AND status = 'ACTIVE' ORDER BY started_at DESC LIMIT 1",
+            _SELECT_ACTIVE_CONVERSATION_SQL,
             (thread_id,),
         ).fetchone()
         if row is None:
             return None
-        return Conversation(**dict(row))
+        conv = _row_to_conversation(row)
+        if cache is not None:
+            cache.put(thread_id, conv)
+        return conv
 
     def finish(
         self,
@@ -241,24 +449,65 @@ class ConversationRepository:
         incident_id: Optional[int] = None,
     ) -> None:
         """Mark a conversation as finished."""
+        cache = getattr(self.conn, "active_conversations", None)
+        if cache is not None:
+            cache.discard(conversation_id)
         self.conn.execute(
-            """UPDATE conversations
-               SET ended_at = ?, status = ?, outcome = ?, incident_id = COALESCE(?, incident_id)
-               WHERE id = ?""",
+            _FINISH_CONVERSATION_SQL,
             (
-                datetime.now().isoformat(),
                 status.value,
                 outcome,
                 incident_id,
                 conversation_id,
             ),
         )
-        self.conn.commit()
+        commit(self.conn)
+
+    def increment_messages(self, conversation_id: str, count: int = 1) -> None:
+        """Increment the total_messages counter by *count* (default 1).
 
-    def increment_messages(self, conversation_id: str) -> None:
-        """Increment the total_messages counter by 1."""
+        Does not commit: it always accompanies a log write, so the caller
+        commits both together (see ``GraphAdapter._flush_log``).
+        """
         self.conn.execute(
-            "UPDATE conversations SET total_messages = total_messages + 1 WHERE id = ?",
-            (conversation_id,),
+            _INCREMENT_MESSAGES_SQL,
+            (count, conversation_id),
         )
-        self.conn.commit()
+        cache = getattr(self.conn, "active_conversations", None)
+        cached = cache.get_by_id(conversation_id) if cache is not None else None
+        if cached is not None:
+            cached.total_messages += count
+
+
+class ClassifyCacheRepository:
+    """Persistent store for accepted classifier candidates.
+
+    Keys are opaque strings chosen by the caller; values are the candidate
+    dicts, stored as JSON. Entries expire after *max_age_days* and only the
+    newest *max_rows* are kept, so a wrong accepted classification is not
+    served forever.
+    """
+
+    def __init__(
+        self, conn: sqlite3.Connection, max_age_days: int = 30, max_rows: int = 5000
+    ) -> None:
+        self.conn = conn
+        self.max_age_days = max_age_days
+        self.max_rows = max_rows
+
+    def get(self, key: str) -> Optional[dict]:
+        row = self.conn.execute(
+            _SELECT_CLASSIFY_CACHE_SQL, (key, f"-{self.max_age_days} days")
+        ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, key: str, candidate: dict) -> None:
+        """Store *candidate* and prune expired or surplus entries."""
+        with transaction(self.conn):
+            self.conn.execute(
+                "INSERT OR REPLACE INTO classify_cache (key, candidate) VALUES (?, ?)",
+                (key, json.dumps(candidate, ensure_ascii=False)),
+            )
+            self.conn.execute(
+                _PRUNE_CLASSIFY_CACHE_SQL, (f"-{self.max_age_days} days", self.max_rows)
+            )
@@ -7,6 +7,8 @@ Simplified flow (1 user interaction, auto-save):
 """
 from __future__ import annotations
 
+from functools import cache
+
 from langgraph.graph import END, START, StateGraph
 
 from src.graph.edges import route_after_classify
@@ -39,4 +41,14 @@ def build_graph():
     return builder.compile()
 
 
-agent = build_graph()
+@cache
+def get_agent():
+    """Return the process-wide compiled graph, building it on first use."""
+    return build_graph()
+
+
+def __getattr__(name: str):
+    # ``agent`` (referenced by langgraph.json) is compiled lazily on access
+    if name == "agent":
+        return get_agent()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -3,6 +3,12 @@ from __future__ import annotations
 
 from typing import Literal
 
+# current_node → next node after classify; anything else retries the description
+_ROUTE_AFTER_CLASSIFY: dict[str, Literal["save", "__end__"]] = {
+    "classify_ok": "save",
+    "unhandled": "__end__",
+}
+
 
 def route_after_classify(
     state: dict,
@@ -11,8 +17,4 @@ def route_after_classify(
 
     After max retries (unhandled) → end without saving.
     """
-    if state.get("current_node") == "classify_ok":
-        return "save"
-    if state.get("current_node") == "unhandled":
-        return "__end__"
-    return "collect_description"
+    return _ROUTE_AFTER_CLASSIFY.get(state.get("current_node"), "collect_description")
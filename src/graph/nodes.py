@@ -8,41 +8,262 @@
 """
 from __future__ import annotations
 
+import hashlib
 import json
-from datetime import datetime
+import logging
+import re
+import sqlite3
+import threading
+import unicodedata
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING
 
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
-from langchain_openai import ChatOpenAI
 from langgraph.types import interrupt
 
-from src.catalog.parser import load_catalog_text, parse_catalog
+from src.catalog.parser import load_catalog_all
 from src.config import CATALOG_PATH, MODEL_NAME, MODEL_TEMPERATURE
 from src.content_safety import check_content_safety
-from src.db.engine import get_connection
-from src.db.repositories import AttachmentRepository, IncidentRepository, UserRepository
+from src.db.engine import get_thread_connection, transaction
+from src.db.repositories import (
+    AttachmentRepository,
+    ClassifyCacheRepository,
+    IncidentRepository,
+    UserRepository,
+)
+from src.graph.state import RESET
 from src.models import (
     Category,
     IncidentRecord,
+    IncidentRow,
     IncidentStatus,
     Severity,
     TicketType,
 )
 from src.prompts.loader import render
 
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
+
+logger = logging.getLogger(__name__)
+
 _llm: ChatOpenAI | None = None
+_llm_lock = threading.Lock()
 
 
 def _get_llm() -> ChatOpenAI:
     global _llm
     if _llm is None:
-        _llm = ChatOpenAI(model=MODEL_NAME, temperature=MODEL_TEMPERATURE)
+        with _llm_lock:
+            if _llm is None:
+                # langchain_openai is heavy; import it on first use only
+                from langchain_openai import ChatOpenAI
+
+                # The classifier only answers with a JSON object; JSON mode
+                # has the API guarantee it, so replies no longer fail to parse
+                _llm = ChatOpenAI(
+                    model=MODEL_NAME,
+                    temperature=MODEL_TEMPERATURE,
+                    model_kwargs={"response_format": {"type": "json_object"}},
+                )
     return _llm
 
 
+def warm_llm() -> None:
+    """Open the LLM client's keep-alive connection ahead of the first request.
+
+    Lists models (no tokens billed) so the TCP + TLS handshake happens at
+    server start instead of inside the first classification. Best-effort.
+    """
+    try:
+        _get_llm().root_client.models.list()
+    except Exception:
+        logger.debug("LLM connection warm-up failed", exc_info=True)
+
+
 # Catalog loaded once at import
-_catalog_templates = parse_catalog(CATALOG_PATH)
-_catalog_by_code = {t.code: t for t in _catalog_templates}
-_catalog_text = load_catalog_text(CATALOG_PATH)
+_catalog_text, _catalog_templates, _catalog_by_code = load_catalog_all(CATALOG_PATH)
+
+# classify.j2 is rendered once: everything before the user's description
+# is byte-identical on every call, so the provider can reuse its prompt
+# cache for the long catalog prefix. Only the description is spliced in.
+_USER_DESCRIPTION_SLOT = "\x00user_description\x00"
+_classify_prefix, _classify_suffix = render(
+    "classify.j2",
+    catalog_text=_catalog_text,
+    user_description=_USER_DESCRIPTION_SLOT,
+    valid_codes=", ".join(sorted(_catalog_by_code)),
+).split(_USER_DESCRIPTION_SLOT)
+
+# Normalized description → accepted LLM candidate. Operators repeat the
+# same short reports, so an exact hit skips the classification call. The
+# catalog is fixed for the life of the process, so entries never go stale.
+_CLASSIFY_CACHE_SIZE = 512
+_classify_cache: dict[str, dict] = {}
+
+# Accepted classifications are also kept in the app DB so they survive
+# restarts; ClassifyCacheRepository expires and caps them. Persisted keys
+# include a hash of the catalog text, so editing the workbook starts a
+# fresh cache.
+_CATALOG_VERSION = hashlib.sha1(_catalog_text.encode()).hexdigest()[:12]
+
+
+# Drops the combining diacritics (U+0300–U+036F) left by NFKD decomposition
+_STRIP_MARKS = dict.fromkeys(range(0x300, 0x370))
+
+
+def _normalize_description(text: str) -> str:
+    """Build the classify cache key: case-folded, unaccented, single-spaced.
+
+    "Cámara" and "camara" map to the same key, so accent slips still hit.
+    """
+    folded = unicodedata.normalize("NFKD", text.casefold()).translate(_STRIP_MARKS)
+    return " ".join(folded.split())
+
+
+# Catalog codes look like "POS-001"; operators who know one often send
+# just the code. Only a bare code counts: inside free text the same shape
+# can be an equipment label, a ticket number or a negation.
+_CODE_RE = re.compile(r"([A-Za-z]{3})-?(\d{3})")
+
+
+def _explicit_code_candidate(text: str) -> dict | None:
+    """Resolve a description that is only a catalog code without the LLM."""
+    match = _CODE_RE.fullmatch(text.strip())
+    if match is None:
+        return None
+    code = f"{match[1].upper()}-{match[2]}"
+    if code not in _catalog_by_code:
+        return None
+    return {"code": code, "confidence": 1.0}
+
+
+# Cache key → in-flight classification, so identical descriptions that
+# arrive together share one LLM call instead of each issuing their own
+_inflight: dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+
+# Runs classification calls concurrently with the content-safety check
+_classify_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="classify")
+
+
+# Trailing commas before a closing bracket, the usual near-miss in LLM JSON
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+
+
+def _parse_candidate(content: str) -> dict:
+    """Return the ``candidate`` object from a classifier reply.
+
+    JSON mode normally yields a bare object, which parses on the first try.
+    Otherwise the outermost ``{...}`` span is cut out of any fences or
+    surrounding prose, trailing commas are dropped and it is parsed again.
+    Returns ``{}`` when no candidate can be recovered, which callers treat
+    like a low-confidence answer.
+    """
+    try:
+        data = json.loads(content)
+    except json.JSONDecodeError:
+        start, end = content.find("{"), content.rfind("}")
+        span = _TRAILING_COMMA_RE.sub(r"\1", content[start : end + 1])
+        try:
+            data = json.loads(span) if 0 <= start < end else None
+        except json.JSONDecodeError:
+            data = None
+    candidate = data.get("candidate") if isinstance(data, dict) else None
+    if not isinstance(candidate, dict):
+        logger.warning("Classifier reply has no candidate object: %.200r", content)
+        return {}
+    return candidate
+
+
+def _classify_with_llm(key: str, user_desc: str) -> dict:
+    """Return the LLM's candidate, joining an identical in-flight request."""
+    with _inflight_lock:
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = _inflight[key] = Future()
+    if not owner:
+        return future.result()
+
+    try:
+        prompt = _classify_prefix + user_desc + _classify_suffix
+        llm = _get_llm()
+        resp = llm.invoke((HumanMessage(content=prompt),))
+        candidate = _parse_candidate(resp.content)
+    except BaseException as exc:
+        future.set_exception(exc)
+        raise
+    else:
+        future.set_result(candidate)
+        return candidate
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+
+
+def _persisted_key(key: str) -> str:
+    return hashlib.sha1(f"{_CATALOG_VERSION}|{key}".encode()).hexdigest()
+
+
+def _cached_candidate(key: str, user_desc: str) -> dict | None:
+    """Return a candidate that needs no LLM call, or None.
+
+    Checks the in-process cache, an explicit catalog code in the text and
+    finally the persisted cache, whose hits are promoted in memory.
+    """
+    candidate = _classify_cache.get(key) or _explicit_code_candidate(user_desc)
+    if candidate is not None:
+        return candidate
+    try:
+        candidate = ClassifyCacheRepository(get_thread_connection()).get(
+            _persisted_key(key)
+        )
+    except sqlite3.Error:
+        logger.debug("Classify cache lookup failed", exc_info=True)
+        return None
+    if candidate is not None:
+        _remember_in_memory(key, candidate)
+    return candidate
+
+
+def _remember_in_memory(key: str, candidate: dict) -> None:
+    if len(_classify_cache) >= _CLASSIFY_CACHE_SIZE:
+        # Evict the oldest entry (dicts keep insertion order)
+        _classify_cache.pop(next(iter(_classify_cache)), None)
+    _classify_cache[key] = candidate
+
+
+def _remember_classification(key: str, candidate: dict) -> None:
+    _remember_in_memory(key, candidate)
+    try:
+        ClassifyCacheRepository(get_thread_connection()).put(
+            _persisted_key(key), candidate
+        )
+    except sqlite3.Error:
+        # The cache is an optimization; never fail a classification over it
+        logger.debug("Classify cache write failed", exc_info=True)
+
+
+def _parse_str(raw: str) -> dict:
+    return {"text": raw, "media": []}
+
+
+def _parse_dict(raw: dict) -> dict:
+    get = raw.get
+    return {"text": get("text", ""), "media": get("media", [])}
+
+
+def _parse_other(raw: object) -> dict:
+    # Subclasses miss the exact-type dispatch below
+    if isinstance(raw, str):
+        return _parse_str(raw)
+    if isinstance(raw, dict):
+        return _parse_dict(raw)
+    return {"text": str(raw), "media": []}
+
+
+_PARSE_DISPATCH = {str: _parse_str, dict: _parse_dict}
 
 
 def _parse_input(raw: object) -> dict:
@@ -51,40 +272,44 @@ def _parse_input(raw: object) -> dict:
     - str  → {"text": raw, "media": []}          (Studio / plain text)
     - dict → expects {"text": ..., "media": [...]}  (WhatsApp adapter)
     """
-    if isinstance(raw, str):
-        return {"text": raw, "media": []}
-    if isinstance(raw, dict):
-        return {
-            "text": raw.get("text", ""),
-            "media": raw.get("media", []),
-        }
-    return {"text": str(raw), "media": []}
+    return _PARSE_DISPATCH.get(type(raw), _parse_other)(raw)
 
 
 # ─── Greeting ──────────────────────────────────────────────────────────
 
+# The greeting has no user context, so its system prompt never changes
+_GREETING_SYSTEM_PROMPT = render("system.j2", user_profile=None, recent_incidents=[])
+_GREETING_MSG = (
+    "Hola, soy el asistente de soporte. "
+    "Cuéntame qué pasó — escríbeme, mándame una foto o una nota de voz."
+)
+
+
 def greeting_node(state: dict) -> dict:
     """Simple greeting. No user lookup, no interrupt."""
     phone = state.get("user_phone", "")
 
-    system_prompt = render("system.j2", user_profile=None, recent_incidents=[])
-    greeting_text = (
-        "Hola, soy el asistente de soporte. "
-        "Cuéntame qué pasó — escríbeme, mándame una foto o una nota de voz."
-    )
-
     return {
         "messages": [
-            SystemMessage(content=system_prompt),
-            AIMessage(content=greeting_text),
+            SystemMessage(content=_GREETING_SYSTEM_PROMPT),
+            AIMessage(content=_GREETING_MSG),
         ],
         "current_node": "greeting",
-        "current_incident": {"reported_by": phone},
+        # New conversation: drop the previous report's fields and media
+        "current_incident": {RESET: True, "reported_by": phone},
+        "media_attachments": [RESET],
     }
 
 
 # ─── Collect Description ──────────────────────────────────────────────
 
+# How media descriptions are appended to the user's text, by media type
+_MEDIA_FMT = {
+    "image": "[Descripción visual: %s]",
+    "audio": "[Transcripción de audio: %s]",
+}
+
+
 def collect_description_node(state: dict) -> dict:
     """Interrupt to get the free-text incident description.
 
@@ -96,18 +321,17 @@ def collect_description_node(state: dict) -> dict:
     parsed = _parse_input(raw)
 
     description = parsed["text"]
-    media_attachments = list(state.get("media_attachments", []))
+    # Only the new items are returned; the state reducer appends them
+    media_attachments: list[dict] = list(parsed["media"])
 
-    extra_parts: list[str] = []
-    for m in parsed.get("media", []):
-        if m.get("type") == "image" and m.get("description"):
-            extra_parts.append(f"[Descripción visual: {m['description']}]")
-        if m.get("type") == "audio" and m.get("description"):
-            extra_parts.append(f"[Transcripción de audio: {m['description']}]")
-        media_attachments.append(m)
+    extra_parts = [
+        _MEDIA_FMT[kind] % desc
+        for m in media_attachments
+        if (kind := m.get("type")) in _MEDIA_FMT and (desc := m.get("description"))
+    ]
 
     if extra_parts:
-        description = (description + "\n" + "\n".join(extra_parts)).strip()
+        description = "\n".join([description, *extra_parts]).strip()
 
     display_text = parsed["text"] or description
     return {
@@ -120,6 +344,45 @@ def collect_description_node(state: dict) -> dict:
 
 # ─── Classify ─────────────────────────────────────────────────────────
 
+_MAX_CLASSIFY_ATTEMPTS = 2
+
+# Message shown when max retries are exhausted
+_UNHANDLED_MSG = (
+    "No parece un incidente relacionado con los sistemas o equipos de la agencia.\n\n"
+    "Si necesitas reportar un problema técnico (computadoras, red, sistema de apuestas, etc.), "
+    "dime y te ayudo.\n\n"
+    "Si se trata de otro tipo de situación, puede que debas comunicarte con el área correspondiente."
+)
+_UNSAFE_RETRY_MSG = (
+    "Ese contenido no está relacionado con operaciones de agencia. "
+    "¿Tienes algún problema con tu terminal, impresora o algún equipo? "
+    "Cuéntame y te ayudo."
+)
+_LOW_CONFIDENCE_RETRY_MSG = (
+    "No estoy seguro de qué tipo de incidente es. "
+    "¿Me puedes dar más detalles?"
+)
+_UNKNOWN_CODE_RETRY_MSG = (
+    "No encontré ese código en el catálogo. "
+    "¿Me puedes describir el problema con otras palabras?"
+)
+
+
+def _classify_failed(attempts: int, retry_msg: str) -> dict:
+    """Ask for more details, or give up once the attempts are exhausted."""
+    if attempts >= _MAX_CLASSIFY_ATTEMPTS:
+        return {
+            "messages": [AIMessage(content=_UNHANDLED_MSG)],
+            "current_node": "unhandled",
+            "classify_attempts": attempts,
+        }
+    return {
+        "messages": [AIMessage(content=retry_msg)],
+        "current_node": "classify_failed",
+        "classify_attempts": attempts,
+    }
+
+
 def classify_node(state: dict) -> dict:
     """Classify automatically using LLM. Top-1 only, no user selection.
 
@@ -130,14 +393,16 @@ def classify_node(state: dict) -> dict:
     user_desc = state.get("user_description", "")
     attempts = state.get("classify_attempts", 0) + 1
 
-    # Message shown when max retries are exhausted
-    _UNHANDLED_MSG = (
-        "No parece un incidente relacionado con los sistemas o equipos de la agencia.\n\n"
-        "Si necesitas reportar un problema técnico (computadoras, red, sistema de apuestas, etc.), "
-        "dime y te ayudo.\n\n"
-        "Si se trata de otro tipo de situación, puede que debas comunicarte con el área correspondiente."
+    # The safety check and the classification are independent LLM calls,
+    # so a cache miss starts classifying in the background while the
+    # safety verdict is fetched; an unsafe verdict discards that result.
+    cache_key = _normalize_description(user_desc)
+    cached = _cached_candidate(cache_key, user_desc)
+    pending = (
+        _classify_pool.submit(_classify_with_llm, cache_key, user_desc)
+        if cached is None
+        else None
     )
-    _MAX_CLASSIFY_ATTEMPTS = 2
 
     # ── Content Safety Check ──────────────────────────────────────
     media_descriptions = [
@@ -148,99 +413,31 @@ def classify_node(state: dict) -> dict:
     safety_result = check_content_safety(user_desc, media_descriptions)
 
     if not safety_result.is_safe:
-        if attempts >= _MAX_CLASSIFY_ATTEMPTS:
-            return {
-                "messages": [AIMessage(content=_UNHANDLED_MSG)],
-                "current_node": "unhandled",
-                "classify_attempts": attempts,
-            }
-        return {
-            "messages": [
-                AIMessage(
-                    content="Ese contenido no está relacionado con operaciones de agencia. "
-                    "¿Tienes algún problema con tu terminal, impresora o algún equipo? "
-                    "Cuéntame y te ayudo."
-                )
-            ],
-            "current_node": "classify_failed",
-            "classify_attempts": attempts,
-        }
+        if pending is not None:
+            # Drops the call if it is still queued behind a busy pool;
+            # one already in flight just finishes unobserved
+            pending.cancel()
+        return _classify_failed(attempts, _UNSAFE_RETRY_MSG)
 
     # ── Classification ────────────────────────────────────────────
-    # Pass the explicit list of valid codes to the prompt
-    valid_codes = ", ".join(sorted(_catalog_by_code.keys()))
-    prompt = render(
-        "classify.j2",
-        catalog_text=_catalog_text,
-        user_description=user_desc,
-        valid_codes=valid_codes,
-    )
-    resp = _get_llm().invoke([HumanMessage(content=prompt)])
-
-    try:
-        data = json.loads(resp.content.strip())
-        candidate = data.get("candidate", {})
-        confidence = candidate.get("confidence", 0)
-    except (json.JSONDecodeError, AttributeError):
-        if attempts >= _MAX_CLASSIFY_ATTEMPTS:
-            return {
-                "messages": [AIMessage(content=_UNHANDLED_MSG)],
-                "current_node": "unhandled",
-                "classify_attempts": attempts,
-            }
-        return {
-            "messages": [
-                AIMessage(
-                    content="No logré ubicar el tipo de incidente con esa información. "
-                    "¿Me puedes dar más detalles de lo que pasó?"
-                )
-            ],
-            "current_node": "classify_failed",
-            "classify_attempts": attempts,
-        }
-
-    if confidence < 0.5 or not candidate.get("code"):
-        if attempts >= _MAX_CLASSIFY_ATTEMPTS:
-            return {
-                "messages": [AIMessage(content=_UNHANDLED_MSG)],
-                "current_node": "unhandled",
-                "classify_attempts": attempts,
-            }
-        return {
-            "messages": [
-                AIMessage(
-                    content="No estoy seguro de qué tipo de incidente es. "
-                    "¿Me puedes dar más detalles?"
-                )
-            ],
-            "current_node": "classify_failed",
-            "classify_attempts": attempts,
-        }
+    # JSON mode keeps replies parseable; one without a usable candidate
+    # comes back as {} and is handled like a low-confidence answer
+    candidate = cached if pending is None else pending.result()
+    if candidate.get("confidence", 0) < 0.5 or not candidate.get("code"):
+        return _classify_failed(attempts, _LOW_CONFIDENCE_RETRY_MSG)
 
     code = candidate["code"]
     template = _catalog_by_code.get(code)
     if not template:
-        if attempts >= _MAX_CLASSIFY_ATTEMPTS:
-            return {
-                "messages": [AIMessage(content=_UNHANDLED_MSG)],
-                "current_node": "unhandled",
-                "classify_attempts": attempts,
-            }
-        return {
-            "messages": [
-                AIMessage(
-                    content="No encontré ese código en el catálogo. "
-                    "¿Me puedes describir el problema con otras palabras?"
-                )
-            ],
-            "current_node": "classify_failed",
-            "classify_attempts": attempts,
-        }
+        return _classify_failed(attempts, _UNKNOWN_CODE_RETRY_MSG)
+
+    if cached is None:
+        _remember_classification(cache_key, candidate)
 
     # Auto-fill incident ALWAYS from the catalog template (never from LLM output)
     # This ensures we never store hallucinated names or data
-    incident = dict(state.get("current_incident", {}))
-    incident.update({
+    # The state reducer merges these keys into current_incident
+    incident = {
         "incident_code": template.code,
         "incident_name": template.name,       # Always from catalog, never from LLM
         "category": template.category.value,
@@ -249,9 +446,8 @@ def classify_node(state: dict) -> dict:
         "ticket_type": template.ticket_type.value,
         "sla": template.sla,
         "description": user_desc,
-        "date_time_reported": datetime.now().isoformat(),
         "status": IncidentStatus.OPEN.value,
-    })
+    }
 
     return {
         "current_incident": incident,
@@ -260,73 +456,127 @@ def classify_node(state: dict) -> dict:
     }
 
 
+# ─── Save ──────────────────────────────────────────────────────────────
 
+_SAVED_MSG = (
+    "Listo, registré tu reporte con folio *%s* (*%s* – %s). "
+    "El equipo de soporte ya lo tiene y le dará seguimiento."
+    "Si el equipo sigue fallando o pasa algo más, escríbeme por aquí."
+)
+
+# IncidentRecord fields taken from current_incident, with their fallbacks.
+# Enum fields stay as plain values; the model coerces them on validation.
+_RECORD_DEFAULTS: dict[str, str] = {
+    "incident_code": "",
+    "incident_name": "",
+    "category": Category.POS.value,
+    "sub_category": "",
+    "severity": Severity.MEDIUM.value,
+    "ticket_type": TicketType.INCIDENTE.value,
+    "sla": "",
+    "reported_by": "",
+    "agency": "",
+    "shift": "",
+    "description": "",
+}
+
+
+# Enum value → member, for building rows without pydantic validation
+_CATEGORIES = {m.value: m for m in Category}
+_SEVERITIES = {m.value: m for m in Severity}
+_TICKET_TYPES = {m.value: m for m in TicketType}
+
+
+def _build_record(fields: dict) -> IncidentRecord | IncidentRow:
+    """Build the record to save from ``_RECORD_DEFAULTS``-shaped *fields*.
+
+    classify_node fills these from the catalog, so they are normally plain
+    strings with valid enum values and a slotted IncidentRow is built
+    directly. Anything else goes through full IncidentRecord validation,
+    which raises on bad data.
+    """
+    if all(type(v) is str for v in fields.values()):
+        try:
+            return IncidentRow(
+                **{
+                    **fields,
+                    "category": _CATEGORIES[fields["category"]],
+                    "severity": _SEVERITIES[fields["severity"]],
+                    "ticket_type": _TICKET_TYPES[fields["ticket_type"]],
+                    "status": IncidentStatus.OPEN,
+                }
+            )
+        except KeyError:
+            pass
+    return IncidentRecord(**fields, status=IncidentStatus.OPEN)
+
+
+_SAVE_FAILED_MSG = (
+    "Hubo un problema al guardar tu reporte.\n"
+    "Intenta de nuevo o escríbeme para empezar uno nuevo."
+)
+
+
+def _save_failed(error: Exception, reported_by: str) -> dict:
+    """Log *error* (call from an ``except`` block) and reply generically.
+
+    The raw error stays in the state for diagnosis; the user never sees
+    database or validation details.
+    """
+    logger.exception("Failed to save incident for %s", reported_by)
+    return {
+        "messages": [AIMessage(content=_SAVE_FAILED_MSG)],
+        "current_node": "error",
+        "error": str(error),
+    }
 
-# ─── Save ──────────────────────────────────────────────────────────────
 
 def save_node(state: dict) -> dict:
     """Persist incident to DB. No interrupt."""
     incident_data = state.get("current_incident", {})
 
     try:
-        record = IncidentRecord(
-            incident_code=incident_data.get("incident_code", ""),
-            incident_name=incident_data.get("incident_name", ""),
-            category=Category(incident_data.get("category", "POS")),
-            sub_category=incident_data.get("sub_category", ""),
-            severity=Severity(incident_data.get("severity", "MEDIUM")),
-            ticket_type=TicketType(incident_data.get("ticket_type", "Incidente")),
-            sla=incident_data.get("sla", ""),
-            reported_by=incident_data.get("reported_by", ""),
-            agency=incident_data.get("agency", ""),
-            shift=incident_data.get("shift", ""),
-            description=incident_data.get("description", ""),
-            status=IncidentStatus.OPEN,
+        known = _RECORD_DEFAULTS.keys() & incident_data.keys()
+        record = _build_record(
+            {**_RECORD_DEFAULTS, **{k: incident_data[k] for k in known}}
         )
     except Exception as e:
-        return {
-            "messages": [
-                AIMessage(
-                    content=f"Hubo un problema al guardar: {e}\n"
-                    "Intenta de nuevo o escríbeme para empezar uno nuevo."
-                )
-            ],
-            "current_node": "error",
-            "error": str(e),
-        }
-
-    conn = get_connection()
-    # Ensure user exists in DB to satisfy FK constraint
-    UserRepository(conn).ensure_exists(record.reported_by)
-    repo = IncidentRepository(conn)
-    incident_id = repo.save(record)
-
-    # Save multimedia attachments
-    media_attachments = state.get("media_attachments", [])
-    if media_attachments:
-        attach_repo = AttachmentRepository(conn)
-        for att in media_attachments:
-            file_path = att.get("file_path", "")
-            if file_path:
-                attach_repo.save(
-                    incident_id=incident_id,
-                    file_path=file_path,
-                    media_type=att.get("type", "unknown"),
-                    original_name=att.get("filename", ""),
-                    description=att.get("description", ""),
-                )
-
-    conn.close()
+        return _save_failed(e, incident_data.get("reported_by", ""))
+
+    # Graph runs reuse worker threads, so keep their connection open
+    conn = get_thread_connection()
+    attachments = [
+        (
+            att["file_path"],
+            att.get("type", "unknown"),
+            att.get("filename", ""),
+            att.get("description", ""),
+        )
+        for att in state.get("media_attachments", [])
+        if att.get("file_path")
+    ]
+    # User stub, incident and multimedia attachments share one commit;
+    # BEGIN IMMEDIATE takes the write lock before the first insert.
+    # transaction() rolls everything back if any insert fails.
+    try:
+        with transaction(conn, immediate=True):
+            # Ensure user exists in DB to satisfy FK constraint
+            UserRepository(conn).ensure_exists(record.reported_by)
+            incident_id = IncidentRepository(conn).save(record)
+            if attachments:
+                # One executemany; the attachment ids aren't needed here
+                AttachmentRepository(conn).save_many(incident_id, attachments)
+    except sqlite3.Error as e:
+        return _save_failed(e, record.reported_by)
 
     return {
         "messages": [
             AIMessage(
-                content=f"Listo, registré tu reporte con folio *{incident_id}* "
-                f"(*{record.incident_code}* – {record.incident_name}). "
-                "El equipo de soporte ya lo tiene y le dará seguimiento."
-                "Si el equipo sigue fallando o pasa algo más, escríbeme por aquí."
+                content=_SAVED_MSG
+                % (incident_id, record.incident_code, record.incident_name)
             )
         ],
         "current_node": "saved",
+        "incident_id": incident_id,
         "error": None,
     }
@@ -8,12 +8,49 @@ from langgraph.graph.message import add_messages
 from typing_extensions import TypedDict
 
 
+# Sentinel a node puts in an update to replace the value instead of merging
+# into it: a dict key for merge_dicts, the first item for extend_list.
+# Plain data so it survives checkpoint serialization.
+RESET = "__reset__"
+
+
+def merge_dicts(current: dict, update: dict) -> dict:
+    """Reducer: nodes return only the keys they change."""
+    if update.get(RESET):
+        return {k: v for k, v in update.items() if k != RESET}
+    return {**current, **update}
+
+
+def extend_list(current: list, update: list) -> list:
+    """Reducer: nodes return only the new items."""
+    if update[:1] == [RESET]:
+        return list(update[1:])
+    return current + update
+
+
+class IncidentDraft(TypedDict, total=False):
+    """Incident fields collected during the conversation (see IncidentRecord)."""
+    reported_by: str
+    incident_code: str
+    incident_name: str
+    category: str
+    sub_category: str
+    severity: str
+    ticket_type: str
+    sla: str
+    description: str
+    status: str
+    agency: str
+    shift: str
+
+
 class ConversationState(TypedDict):
     messages: Annotated[list[AnyMessage], add_messages]
     user_phone: str
     user_description: str           # free-text description from user
-    current_incident: dict          # incident data (auto-filled by classify)
+    current_incident: Annotated[IncidentDraft, merge_dicts]  # auto-filled by classify
     current_node: str               # for routing
     error: Optional[str]
-    media_attachments: list[dict]   # [{bytes, filename, type, description}]
+    media_attachments: Annotated[list[dict], extend_list]  # [{bytes, filename, type, description}]
     classify_attempts: int          # number of classification attempts (for retry limit)
+    incident_id: Optional[int]      # id of the saved incident (set by save)
@@ -43,13 +43,18 @@ async def transcribe_audio(audio_bytes: bytes, mime_type: str) -> str:
     return transcription.text
 
 
-async def analyze_image(image_bytes: bytes, context: str = "") -> str:
+async def analyze_image(
+    image_bytes: bytes, context: str = "", mime_type: str = "image/jpeg"
+) -> str:
     """Analyze an image using GPT-4o Vision.
 
     Returns a textual description of the image in the context of
-    industrial incident reporting.
+    industrial incident reporting. *mime_type* labels the inline data URL.
     """
-    b64_image = base64.b64encode(image_bytes).decode("utf-8")
+    # Each image is described once, so an inline data URL beats a Files
+    # API upload round-trip; base64 output is pure ASCII
+    b64_image = base64.b64encode(image_bytes).decode("ascii")
+    image_url = f"data:{mime_type};base64,{b64_image}"
 
     prompt = (
         "Describe lo que ves en esta imagen en el contexto de un reporte "
@@ -73,9 +78,7 @@ async def analyze_image(image_bytes: bytes, context: str = "") -> str:
                     {"type": "text", "text": prompt},
                     {
                         "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{b64_image}",
-                        },
+                        "image_url": {"url": image_url},
                     },
                 ],
             }
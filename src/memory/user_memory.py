@@ -10,7 +10,7 @@ from src.models import UserProfile
 
 def load_user_context(
     conn: sqlite3.Connection, phone_number: str
-) -> tuple[Optional[UserProfile], list[dict]]:
+) -> tuple[Optional[UserProfile], list[sqlite3.Row]]:
     """Return (profile_or_None, recent_incidents) for the given phone."""
     user_repo = UserRepository(conn)
     incident_repo = IncidentRepository(conn)
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import enum
+from dataclasses import dataclass
 from datetime import datetime
 from typing import Optional
 
@@ -103,7 +104,7 @@ class IncidentRecord(BaseModel):
     severity: Severity
     ticket_type: TicketType = TicketType.INCIDENTE
     sla: str = ""
-    date_time_reported: datetime = Field(default_factory=datetime.now)
+    date_time_reported: Optional[datetime] = None  # None → stamped by the DB
     reported_by: str  # phone_number FK
     agency: str = ""
     shift: str = ""
@@ -115,3 +116,30 @@ class IncidentRecord(BaseModel):
     closed_by: Optional[str] = None
     closed_at: Optional[datetime] = None
     created_at: datetime = Field(default_factory=datetime.now)
+
+
+@dataclass(slots=True, frozen=True)
+class IncidentRow:
+    """Unvalidated write-side mirror of IncidentRecord.
+
+    For data that is already typed (e.g. catalog-filled incidents); the
+    repositories accept either class. Use IncidentRecord at API boundaries.
+    """
+    incident_code: str
+    incident_name: str
+    category: Category
+    severity: Severity
+    reported_by: str
+    sub_category: str = ""
+    ticket_type: TicketType = TicketType.INCIDENTE
+    sla: str = ""
+    date_time_reported: Optional[datetime] = None
+    agency: str = ""
+    shift: str = ""
+    description: str = ""
+    status: IncidentStatus = IncidentStatus.OPEN
+    root_cause: Optional[str] = None
+    corrective_action: Optional[str] = None
+    preventive_action: Optional[str] = None
+    closed_by: Optional[str] = None
+    closed_at: Optional[datetime] = None
@@ -12,6 +12,8 @@ _env = Environment(
     autoescape=select_autoescape([]),
     trim_blocks=True,
     lstrip_blocks=True,
+    # The template set is small and fixed; never evict a compiled template
+    cache_size=-1,
 )
 
 
@@ -4,9 +4,12 @@ Manages per-user threads and translates multimedia into graph inputs.
 """
 from __future__ import annotations
 
+import asyncio
 import logging
+import re
 import sqlite3
 import time
+import weakref
 from typing import Any
 
 from langchain_core.messages import AIMessage
@@ -14,7 +17,7 @@ from langgraph.checkpoint.sqlite import SqliteSaver
 from langgraph.types import Command
 
 from src.config import CHECKPOINT_DB_PATH
-from src.db.engine import get_connection
+from src.db.engine import apply_pragmas, get_thread_connection, transaction
 from src.db.repositories import (
     ConversationLogRepository,
     ConversationRepository,
@@ -22,53 +25,92 @@ from src.db.repositories import (
     UserRepository,
 )
 from src.models import ConversationStatus
-from src.graph.builder import build_graph
+from src.graph.builder import get_agent
 from src.media.processor import (
     analyze_image,
-    save_media_file,
     transcribe_audio,
 )
 from src.whatsapp.client import IncomingMessage, download_media
 
 logger = logging.getLogger(__name__)
 
+# Image MIME type → saved file extension (anything else is stored as .jpg)
+_IMAGE_EXTENSIONS = {"image/png": ".png", "image/webp": ".webp"}
+
+# Message types whose input needs a download plus a Whisper/Vision call
+_MEDIA_TYPES = frozenset({"audio", "image"})
+
+# Greeting / chitchat patterns that should NOT be treated as input data
+_GREETING_PATTERNS = {
+    "hola", "hello", "hi", "hey", "buenos dias", "buenos días",
+    "buenas tardes", "buenas noches", "buenas", "buen dia", "buen día",
+    "que tal", "qué tal", "ola", "saludos", "holi", "holaa",
+}
+# One pass over the raw text; long messages fail on the first words
+# instead of being lower-cased and stripped in full.
+_GREETING_RE = re.compile(
+    r"\s*(?:"
+    + "|".join(map(re.escape, sorted(_GREETING_PATTERNS, key=len, reverse=True)))
+    + r")[!.?,;]*\s*",
+    re.IGNORECASE,
+)
+
+
+def _discard(fut: asyncio.Future) -> None:
+    """Cancel *fut*, or mark its exception as retrieved if it already failed."""
+    if not fut.cancel() and not fut.cancelled():
+        fut.exception()
+
 
 class GraphAdapter:
     """Stateful adapter that routes WhatsApp messages into the LangGraph agent."""
 
     def __init__(self) -> None:
         conn = sqlite3.connect(str(CHECKPOINT_DB_PATH), check_same_thread=False)
+        apply_pragmas(conn)
         self._checkpointer = SqliteSaver(conn)
         self._checkpointer.setup()
-        self._graph = build_graph().copy()
+        # Shallow copy of the shared compiled graph; only the checkpointer differs
+        self._graph = get_agent().copy()
         # Patch the checkpointer onto the compiled graph
         self._graph.checkpointer = self._checkpointer
         # phone_number → bool (whether the thread has been started)
         self._known_threads: dict[str, bool] = {}
+        # phone_number → lock serializing that user's messages
+        self._thread_locks: weakref.WeakValueDictionary[str, asyncio.Lock] = (
+            weakref.WeakValueDictionary()
+        )
+        # Caps concurrent media downloads + OpenAI media calls across users
+        self._media_slots = asyncio.Semaphore(8)
 
     # ── public API ──────────────────────────────────────────────────
 
     def reset_thread(self, thread_id: str) -> None:
         """Remove all checkpoint data for a thread, forcing a fresh start."""
         self._known_threads.pop(thread_id, None)
-        # Delete checkpoints from SQLite directly
-        conn = self._checkpointer.conn
-        conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
-        conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
-        conn.commit()
+        # Graph runs in worker threads share the saver's connection; going
+        # through the saver takes its lock, so this never commits or
+        # interleaves with another user's half-written checkpoint.
+        self._checkpointer.delete_thread(thread_id)
         logger.info("Thread %s reset", thread_id)
 
-    # Greeting / chitchat patterns that should NOT be treated as input data
-    _GREETING_PATTERNS = {
-        "hola", "hello", "hi", "hey", "buenos dias", "buenos días",
-        "buenas tardes", "buenas noches", "buenas", "buen dia", "buen día",
-        "que tal", "qué tal", "ola", "saludos", "holi", "holaa",
-    }
-
     def _is_greeting(self, text: str) -> bool:
         """Check if a message is just a greeting with no real content."""
-        normalized = text.strip().lower().rstrip("!.?,;")
-        return normalized in self._GREETING_PATTERNS
+        return _GREETING_RE.fullmatch(text) is not None
+
+    # Slash command → DB-writing handler, resolved with one dict lookup
+    _DB_COMMANDS = {
+        "/reset": "_cmd_reset",
+        "/borrar": "_cmd_borrar",
+        "/eliminar_usuario": "_cmd_eliminar_usuario",
+    }
+    _HELP_MSG = (
+        "Comandos disponibles:\n"
+        "  /reset — Reiniciar la conversación actual\n"
+        "  /borrar — Eliminar tu perfil y reiniciar el chat\n"
+        "  /eliminar_usuario — Eliminar solo tu perfil de la BD\n"
+        "  /ayuda — Mostrar esta lista de comandos"
+    )
 
     def _handle_command(self, text: str, thread_id: str) -> str | None:
         """Check if *text* is a slash command and execute it.
@@ -76,29 +118,19 @@ class GraphAdapter:
         Returns a response string if it was a command, or ``None`` to
         continue with the normal LangGraph flow.
         """
-        stripped = text.strip().lower()
+        # Most messages are not commands: bail out before normalizing
+        stripped = text.lstrip()
         if not stripped.startswith("/"):
             return None
 
-        cmd = stripped.split()[0]
-
-        if cmd == "/reset":
-            return self._exec_db_command(self._cmd_reset, thread_id)
-
-        if cmd == "/borrar":
-            return self._exec_db_command(self._cmd_borrar, thread_id)
+        cmd = stripped.split(maxsplit=1)[0].casefold()
 
-        if cmd == "/eliminar_usuario":
-            return self._exec_db_command(self._cmd_eliminar_usuario, thread_id)
+        handler = self._DB_COMMANDS.get(cmd)
+        if handler is not None:
+            return self._exec_db_command(getattr(self, handler), thread_id)
 
         if cmd == "/ayuda":
-            return (
-                "Comandos disponibles:\n"
-                "  /reset — Reiniciar la conversación actual\n"
-                "  /borrar — Eliminar tu perfil y reiniciar el chat\n"
-                "  /eliminar_usuario — Eliminar solo tu perfil de la BD\n"
-                "  /ayuda — Mostrar esta lista de comandos"
-            )
+            return self._HELP_MSG
 
         return (
             f"Comando desconocido: {cmd}\n"
@@ -108,43 +140,34 @@ class GraphAdapter:
     # ── command implementations ────────────────────────────────────
 
     def _cmd_reset(self, thread_id: str) -> str:
-        app_conn = get_connection()
-        try:
-            conv_repo = ConversationRepository(app_conn)
-            active = conv_repo.get_active(thread_id)
-            if active:
-                conv_repo.finish(active.id, ConversationStatus.CANCELLED, outcome="Reset por usuario")
-            self.reset_thread(thread_id)
-            ConversationLogRepository(app_conn).delete_thread(thread_id)
-        finally:
-            app_conn.close()
+        app_conn = get_thread_connection()
+        conv_repo = ConversationRepository(app_conn)
+        active = conv_repo.get_active(thread_id)
+        if active:
+            conv_repo.finish(active.id, ConversationStatus.CANCELLED, outcome="Reset por usuario")
+        self.reset_thread(thread_id)
+        ConversationLogRepository(app_conn).delete_thread(thread_id)
         return "Conversación reiniciada. Puedes empezar de nuevo enviando un mensaje."
 
     def _cmd_borrar(self, thread_id: str) -> str:
-        app_conn = get_connection()
-        try:
-            conv_repo = ConversationRepository(app_conn)
-            active = conv_repo.get_active(thread_id)
-            if active:
-                conv_repo.finish(active.id, ConversationStatus.CANCELLED, outcome="Borrado por usuario")
-            self.reset_thread(thread_id)
-            ConversationLogRepository(app_conn).delete_thread(thread_id)
-            IncidentRepository(app_conn).delete_by_user(thread_id)
-            UserRepository(app_conn).delete(thread_id)
-        finally:
-            app_conn.close()
+        app_conn = get_thread_connection()
+        conv_repo = ConversationRepository(app_conn)
+        active = conv_repo.get_active(thread_id)
+        if active:
+            conv_repo.finish(active.id, ConversationStatus.CANCELLED, outcome="Borrado por usuario")
+        self.reset_thread(thread_id)
+        ConversationLogRepository(app_conn).delete_thread(thread_id)
+        IncidentRepository(app_conn).delete_by_user(thread_id)
+        UserRepository(app_conn).delete(thread_id)
         return (
             "Tu perfil y conversación han sido eliminados. "
             "Si envías un nuevo mensaje, comenzarás desde cero."
         )
 
     def _cmd_eliminar_usuario(self, thread_id: str) -> str:
-        app_conn = get_connection()
-        try:
-            IncidentRepository(app_conn).delete_by_user(thread_id)
-            UserRepository(app_conn).delete(thread_id)
-        finally:
-            app_conn.close()
+        app_conn = get_thread_connection()
+        IncidentRepository(app_conn).delete_by_user(thread_id)
+        UserRepository(app_conn).delete(thread_id)
         return (
             "Tu perfil ha sido eliminado de la base de datos. "
             "La conversación actual sigue activa."
@@ -158,6 +181,8 @@ class GraphAdapter:
                 return fn(thread_id)
             except sqlite3.OperationalError as exc:
                 if "locked" in str(exc) and attempt < max_retries - 1:
+                    # Discard partial writes left on the shared connection
+                    get_thread_connection().rollback()
                     wait = 0.3 * (attempt + 1)
                     logger.warning("DB locked on attempt %d, retrying in %.1fs…", attempt + 1, wait)
                     time.sleep(wait)
@@ -166,7 +191,37 @@ class GraphAdapter:
         return "Error interno al procesar el comando. Intenta de nuevo."
 
     async def handle_message(self, msg: IncomingMessage) -> str:
-        """Process an incoming WhatsApp message and return the reply text."""
+        """Process an incoming WhatsApp message and return the reply text.
+
+        Graph runs (and their LLM calls) execute in a worker thread so the
+        event loop keeps serving other users; messages from the same user
+        are still processed one at a time.
+        """
+        lock = self._thread_locks.get(msg.from_number)
+        if lock is None:
+            lock = self._thread_locks[msg.from_number] = asyncio.Lock()
+        # Media processing doesn't touch the conversation, so it starts
+        # before queueing: photos and voice notes sent back to back are
+        # analyzed concurrently and only the graph steps run one at a time.
+        pending_input = (
+            asyncio.ensure_future(self._build_media_input(msg))
+            if msg.type in _MEDIA_TYPES and msg.media_id
+            else None
+        )
+        try:
+            async with lock:
+                return await self._handle_message(msg, pending_input)
+        finally:
+            if pending_input is not None:
+                _discard(pending_input)
+
+    async def _build_media_input(self, msg: IncomingMessage) -> str | dict:
+        async with self._media_slots:
+            return await self._build_input(msg)
+
+    async def _handle_message(
+        self, msg: IncomingMessage, pending_input: asyncio.Future | None = None
+    ) -> str:
         thread_id = msg.from_number
         config: dict[str, Any] = {
             "configurable": {"thread_id": thread_id}
@@ -179,80 +234,118 @@ class GraphAdapter:
                 return command_reply
 
         # Build the input value (text + optional media)
-        input_value = await self._build_input(msg)
+        if pending_input is not None:
+            input_value = await pending_input
+        else:
+            input_value = await self._build_input(msg)
 
         # --- Conversation tracking setup ---
-        app_conn = get_connection()
+        app_conn = get_thread_connection()
         conv_repo = ConversationRepository(app_conn)
-        log_repo = ConversationLogRepository(app_conn)
+        # Log lines (and the closing of a finished conversation) are buffered
+        # and written in one transaction per message
+        log_rows: list[tuple[str, str, str, str | None]] = []
+        finish: tuple | None = None
 
-        if not self._is_thread_started(thread_id):
-            # First message → create a new conversation session
-            conversation = conv_repo.create(thread_id)
-
-            # First message from this user → invoke from START
-            result = self._graph.invoke(
-                {"user_phone": thread_id},
-                config=config,
-            )
-            self._known_threads[thread_id] = True
-
-            # Log the user message
-            user_text = input_value if isinstance(input_value, str) else input_value.get("text", "")
-            log_repo.append(thread_id, "user", user_text, conversation.id)
-            conv_repo.increment_messages(conversation.id)
-
-            # If the first message is a greeting, just return the
-            # greeting response — don't feed it as input data
-            text_part = input_value if isinstance(input_value, str) else input_value.get("text", "")
-            if self._is_greeting(text_part):
-                reply = self._extract_reply(result)
-                log_repo.append(thread_id, "assistant", reply, conversation.id)
-                conv_repo.increment_messages(conversation.id)
-                app_conn.close()
-                return reply
-
-            # The message has real content → resume immediately
-            result = self._graph.invoke(
-                Command(resume=input_value),
-                config=config,
-            )
-        else:
-            # Get or create conversation for this thread
-            conversation = conv_repo.get_active(thread_id)
-            if not conversation:
+        try:
+            if not self._is_thread_started(thread_id):
+                # First message → create a new conversation session
                 conversation = conv_repo.create(thread_id)
 
-            # Log the user message
-            user_text = input_value if isinstance(input_value, str) else input_value.get("text", "")
-            log_repo.append(thread_id, "user", user_text, conversation.id)
-            conv_repo.increment_messages(conversation.id)
-
-            # Subsequent message → resume the paused graph
-            result = self._graph.invoke(
-                Command(resume=input_value),
-                config=config,
-            )
-
-        reply = self._extract_reply(result)
-
-        # Log the assistant reply
-        log_repo.append(thread_id, "assistant", reply, conversation.id)
-        conv_repo.increment_messages(conversation.id)
+                # First message from this user → invoke from START
+                result = await asyncio.to_thread(
+                    self._graph.invoke,
+                    {"user_phone": thread_id},
+                    config=config,
+                )
+                self._known_threads[thread_id] = True
 
-        # If the graph reached a terminal state, finish the conversation
-        if self._is_thread_finished(thread_id):
-            self._known_threads.pop(thread_id, None)
-            # Determine outcome from graph state
-            state = self._graph.get_state(config)
-            current_node = (state.values or {}).get("current_node", "") if state and state.values else ""
-            if current_node == "saved":
-                conv_repo.finish(conversation.id, ConversationStatus.COMPLETED, outcome="Incidente creado")
+                # Log the user message
+                user_text = input_value if isinstance(input_value, str) else input_value.get("text", "")
+                log_rows.append((thread_id, "user", user_text, conversation.id))
+
+                # If the first message is a greeting, just return the
+                # greeting response — don't feed it as input data
+                text_part = input_value if isinstance(input_value, str) else input_value.get("text", "")
+                if self._is_greeting(text_part):
+                    reply = self._extract_reply(result)
+                    log_rows.append((thread_id, "assistant", reply, conversation.id))
+                    return reply
+
+                # The message has real content → resume immediately
+                result = await asyncio.to_thread(
+                    self._graph.invoke,
+                    Command(resume=input_value),
+                    config=config,
+                )
             else:
-                conv_repo.finish(conversation.id, ConversationStatus.COMPLETED, outcome="Conversación completada")
+                # Get or create conversation for this thread
+                conversation = conv_repo.get_active(thread_id)
+                if not conversation:
+                    conversation = conv_repo.create(thread_id)
+
+                # Log the user message
+                user_text = input_value if isinstance(input_value, str) else input_value.get("text", "")
+                log_rows.append((thread_id, "user", user_text, conversation.id))
+
+                # Subsequent message → resume the paused graph
+                result = await asyncio.to_thread(
+                    self._graph.invoke,
+                    Command(resume=input_value),
+                    config=config,
+                )
+
+            reply = self._extract_reply(result)
+
+            # Log the assistant reply
+            log_rows.append((thread_id, "assistant", reply, conversation.id))
+
+            # If the graph reached a terminal state, finish the conversation
+            if self._is_thread_finished(thread_id):
+                self._known_threads.pop(thread_id, None)
+                # Determine outcome from graph state
+                state = self._graph.get_state(config)
+                values = (state.values or {}) if state else {}
+                if values.get("current_node", "") == "saved":
+                    finish = (
+                        conversation.id,
+                        ConversationStatus.COMPLETED,
+                        "Incidente creado",
+                        values.get("incident_id"),
+                    )
+                else:
+                    finish = (
+                        conversation.id,
+                        ConversationStatus.COMPLETED,
+                        "Conversación completada",
+                        None,
+                    )
+
+            return reply
+        finally:
+            self._flush_log(app_conn, log_rows, finish)
 
-        app_conn.close()
-        return reply
+    @staticmethod
+    def _flush_log(
+        conn: sqlite3.Connection,
+        rows: list[tuple[str, str, str, str | None]],
+        finish: tuple | None = None,
+    ) -> None:
+        """Write buffered log lines, bump the message counter and, when given,
+        finish the conversation, all in one commit.
+
+        *finish* holds ``ConversationRepository.finish`` arguments
+        (conversation_id, status, outcome, incident_id).
+        """
+        if not rows and finish is None:
+            return
+        with transaction(conn):
+            conv_repo = ConversationRepository(conn)
+            if rows:
+                ConversationLogRepository(conn).append_many(rows)
+                conv_repo.increment_messages(rows[0][3], len(rows))
+            if finish is not None:
+                conv_repo.finish(*finish)
 
     # ── private helpers ─────────────────────────────────────────────
 
@@ -304,18 +397,18 @@ class GraphAdapter:
 
         elif msg.type == "image" and msg.media_id:
             image_bytes, content_type = await download_media(msg.media_id)
+            mime = (msg.mime_type or content_type).partition(";")[0].strip().lower()
+            ext = _IMAGE_EXTENSIONS.get(mime, ".jpg")
+
             description = await analyze_image(
-                image_bytes, context=msg.text or ""
+                image_bytes,
+                context=msg.text or "",
+                # Same rule as the extension: unknown types are sent as JPEG
+                mime_type=mime if mime in _IMAGE_EXTENSIONS else "image/jpeg",
             )
             logger.info("Image analyzed: %s...", description[:80])
             text = msg.text or ""
 
-            ext = ".jpg"
-            if "png" in (msg.mime_type or content_type):
-                ext = ".png"
-            elif "webp" in (msg.mime_type or content_type):
-                ext = ".webp"
-
             media_items.append(
                 {
                     "type": "image",
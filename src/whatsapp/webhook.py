@@ -2,18 +2,30 @@
 from __future__ import annotations
 
 import logging
+import threading
+from contextlib import asynccontextmanager
 
 from fastapi import BackgroundTasks, FastAPI, Query, Request
 from fastapi.responses import PlainTextResponse
 
 from src.config import WHATSAPP_VERIFY_TOKEN
 from src.db.engine import init_db
+from src.graph.nodes import warm_llm
 from src.whatsapp.client import parse_webhook_message, send_text_message
 from src.whatsapp.graph_adapter import GraphAdapter
 
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="WhatsApp Incident Bot")
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    # Warm the LLM HTTPS connection in the background so the first user
+    # message doesn't pay the TLS handshake
+    threading.Thread(target=warm_llm, name="llm-warmup", daemon=True).start()
+    yield
+
+
+app = FastAPI(title="WhatsApp Incident Bot", lifespan=_lifespan)
 
 _adapter: GraphAdapter | None = None
 
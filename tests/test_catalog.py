@@ -0,0 +1,56 @@
+"""Tests for the catalog parser's in-memory cache."""
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from src.catalog import parser
+from src.config import CATALOG_PATH
+
+
+class ParseCacheTests(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.workbook = Path(tmp.name) / CATALOG_PATH.name
+        shutil.copy2(CATALOG_PATH, self.workbook)
+        parser._parse_catalog_cached.cache_clear()
+        self.addCleanup(parser._parse_catalog_cached.cache_clear)
+
+    def misses(self) -> int:
+        return parser._parse_catalog_cached.cache_info().misses
+
+    def test_unchanged_workbook_is_parsed_once(self) -> None:
+        first = parser.parse_catalog(self.workbook)
+        second = parser.parse_catalog(self.workbook)
+
+        self.assertEqual(self.misses(), 1)
+        self.assertEqual(first, second)
+        self.assertTrue(first)
+
+    def test_edited_workbook_is_reparsed(self) -> None:
+        parser.parse_catalog(self.workbook)
+        later = os.path.getmtime(self.workbook) + 10
+        os.utime(self.workbook, (later, later))
+
+        parser.parse_catalog(self.workbook)
+
+        self.assertEqual(self.misses(), 2)
+
+    def test_callers_get_their_own_list(self) -> None:
+        templates = parser.parse_catalog(self.workbook)
+        templates.clear()
+
+        self.assertTrue(parser.parse_catalog(self.workbook))
+
+    def test_parsing_leaves_no_files_behind(self) -> None:
+        parser.parse_catalog(self.workbook)
+
+        self.assertEqual(os.listdir(self.workbook.parent), [self.workbook.name])
+
+
+if __name__ == "__main__":
+    unittest.main()
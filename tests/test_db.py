@@ -0,0 +1,428 @@
+"""Tests for the SQLite engine and repositories."""
+from __future__ import annotations
+
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+from src.db.engine import (
+    ActiveConversationCache,
+    commit,
+    get_connection,
+    init_db,
+    transaction,
+)
+from src.db.repositories import (
+    AttachmentRepository,
+    ClassifyCacheRepository,
+    ConversationLogRepository,
+    ConversationRepository,
+    IncidentRepository,
+    UserRepository,
+)
+from src.models import Category, ConversationStatus, IncidentRecord, Severity
+
+
+def _record(phone: str) -> IncidentRecord:
+    return IncidentRecord(
+        incident_code="POS-001",
+        incident_name="n",
+        category=Category.POS,
+        severity=Severity.HIGH,
+        reported_by=phone,
+    )
+
+
+class _DBTestCase(unittest.TestCase):
+    """Fresh app DB in a temporary directory for every test."""
+
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.db_path = Path(tmp.name) / "chatbot.db"
+        init_db(self.db_path)
+        self.conn = get_connection(self.db_path)
+        self.addCleanup(self.conn.close)
+
+    def count(self, table: str) -> int:
+        # A second connection only sees committed rows
+        other = get_connection(self.db_path)
+        try:
+            return other.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+        finally:
+            other.close()
+
+
+class TransactionTests(_DBTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.users = UserRepository(self.conn)
+
+    def test_commits_on_exit(self) -> None:
+        with transaction(self.conn):
+            self.users.ensure_exists("1")
+            self.users.ensure_exists("2")
+            self.assertEqual(self.count("users"), 0)
+
+        self.assertEqual(self.count("users"), 2)
+        self.assertFalse(self.conn.in_transaction)
+
+    def test_rolls_back_on_error(self) -> None:
+        with self.assertRaises(RuntimeError), transaction(self.conn):
+            self.users.ensure_exists("1")
+            raise RuntimeError
+
+        self.assertEqual(self.count("users"), 0)
+        self.assertFalse(self.conn.in_transaction)
+
+    def test_nested_blocks_join_the_outer_transaction(self) -> None:
+        with transaction(self.conn):
+            with transaction(self.conn):
+                self.users.ensure_exists("1")
+            # The inner block must not have committed
+            self.assertEqual(self.count("users"), 0)
+            self.users.ensure_exists("2")
+
+        self.assertEqual(self.count("users"), 2)
+
+    def test_error_in_nested_block_rolls_back_everything(self) -> None:
+        with self.assertRaises(RuntimeError), transaction(self.conn):
+            self.users.ensure_exists("1")
+            with transaction(self.conn):
+                self.users.ensure_exists("2")
+                raise RuntimeError
+
+        self.assertEqual(self.count("users"), 0)
+
+    def test_commit_is_deferred_inside_a_transaction(self) -> None:
+        with transaction(self.conn):
+            self.conn.execute("INSERT INTO users (phone_number) VALUES ('1')")
+            commit(self.conn)
+            self.assertTrue(self.conn.in_transaction)
+            self.assertEqual(self.count("users"), 0)
+
+        self.assertEqual(self.count("users"), 1)
+
+    def test_immediate_takes_the_write_lock_up_front(self) -> None:
+        statements: list[str] = []
+        self.conn.set_trace_callback(statements.append)
+
+        with transaction(self.conn, immediate=True):
+            self.assertEqual(statements[0], "BEGIN IMMEDIATE")
+            other = sqlite3.connect(self.db_path, timeout=0)
+            try:
+                with self.assertRaises(sqlite3.OperationalError):
+                    other.execute("BEGIN IMMEDIATE")
+            finally:
+                other.close()
+
+
+class AppendManyTests(_DBTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.log = ConversationLogRepository(self.conn)
+        self.conv = ConversationRepository(self.conn).create("555")
+        self.statements: list[str] = []
+        self.conn.set_trace_callback(self.statements.append)
+
+    def commits(self) -> int:
+        return self.statements.count("COMMIT")
+
+    def test_inserts_all_rows_in_one_commit(self) -> None:
+        rows = [("555", "user", f"m{i}", self.conv.id) for i in range(50)]
+
+        self.assertEqual(self.log.append_many(rows), 50)
+
+        self.assertEqual(self.commits(), 1)
+        self.assertEqual(self.count("conversation_log"), 50)
+
+    def test_accepts_a_generator(self) -> None:
+        rows = (("555", "user", f"m{i}", self.conv.id) for i in range(3))
+
+        self.assertEqual(self.log.append_many(rows), 3)
+        self.assertEqual(self.commits(), 1)
+
+    def test_joins_an_enclosing_transaction(self) -> None:
+        with transaction(self.conn):
+            self.log.append_many([("555", "user", "a", self.conv.id)])
+            self.log.append_many([("555", "assistant", "b", self.conv.id)])
+            self.assertEqual(self.commits(), 0)
+
+        self.assertEqual(self.commits(), 1)
+        self.assertEqual(self.count("conversation_log"), 2)
+
+    def test_failing_row_rolls_back_the_batch(self) -> None:
+        rows = [
+            ("555", "user", "ok", self.conv.id),
+            ("555", "user", "bad", "no-such-conversation"),
+        ]
+
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.log.append_many(rows)
+
+        self.assertEqual(self.count("conversation_log"), 0)
+        self.assertFalse(self.conn.in_transaction)
+
+    def test_failing_iterable_rolls_back_the_batch(self) -> None:
+        def rows():
+            yield ("555", "user", "first", self.conv.id)
+            raise RuntimeError("export truncated")
+
+        with self.assertRaises(RuntimeError):
+            self.log.append_many(rows())
+
+        self.assertEqual(self.count("conversation_log"), 0)
+
+
+class TimestampNormalizationTests(_DBTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        UserRepository(self.conn).ensure_exists("555")
+        self.incidents = IncidentRepository(self.conn)
+
+    def _insert(self, code: str, reported_at: str) -> None:
+        self.conn.execute(
+            """INSERT INTO incidents
+               (incident_code, incident_name, category, severity, reported_by,
+                date_time_reported)
+               VALUES (?, 'n', 'POS', 'HIGH', '555', ?)""",
+            (code, reported_at),
+        )
+
+    def _simulate_legacy_db(self) -> None:
+        # Same day, so only the " " / "T" separator decides text order
+        self._insert("OLD-1", "2024-05-02T09:00:00.123456")
+        self._insert("OLD-2", "2024-05-02T18:30:00")
+        self._insert("NEW-1", "2024-05-02 12:00:00")
+        self.conn.execute("PRAGMA user_version = 0")
+
+    def test_mixed_formats_sort_chronologically_after_init(self) -> None:
+        self._simulate_legacy_db()
+
+        init_db(self.db_path)
+
+        codes = [r["incident_code"] for r in self.incidents.get_recent_by_user("555")]
+        self.assertEqual(codes, ["OLD-2", "NEW-1", "OLD-1"])
+        stored = {
+            row[0]
+            for row in self.conn.execute("SELECT date_time_reported FROM incidents")
+        }
+        self.assertEqual(
+            stored,
+            {"2024-05-02 09:00:00", "2024-05-02 18:30:00", "2024-05-02 12:00:00"},
+        )
+
+    def test_runs_once_per_database(self) -> None:
+        self._simulate_legacy_db()
+        init_db(self.db_path)
+        # Rows written in the old format afterwards are left alone
+        self._insert("LATE", "2024-06-01T00:00:00")
+
+        init_db(self.db_path)
+
+        value = self.conn.execute(
+            "SELECT date_time_reported FROM incidents WHERE incident_code = 'LATE'"
+        ).fetchone()[0]
+        self.assertEqual(value, "2024-06-01T00:00:00")
+
+    def test_new_rows_use_the_normalized_format(self) -> None:
+        self.incidents.save(_record("555"))
+
+        value = self.conn.execute(
+            "SELECT date_time_reported FROM incidents"
+        ).fetchone()[0]
+        self.assertRegex(value, r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$")
+
+
+class ActiveConversationCacheTests(unittest.TestCase):
+    def _conv(self, conv_id: str) -> SimpleNamespace:
+        return SimpleNamespace(id=conv_id)
+
+    def test_put_get_and_discard(self) -> None:
+        cache = ActiveConversationCache()
+        conv = self._conv("c1")
+        cache.put("555", conv)
+
+        self.assertIs(cache.get("555"), conv)
+        self.assertIs(cache.get_by_id("c1"), conv)
+
+        cache.discard("c1")
+        self.assertIsNone(cache.get("555"))
+        self.assertIsNone(cache.get_by_id("c1"))
+
+    def test_new_conversation_replaces_the_threads_entry(self) -> None:
+        cache = ActiveConversationCache()
+        cache.put("555", self._conv("c1"))
+        cache.put("555", self._conv("c2"))
+
+        self.assertEqual(cache.get("555").id, "c2")
+        self.assertIsNone(cache.get_by_id("c1"))
+
+    def test_evicts_the_least_recently_used_thread(self) -> None:
+        cache = ActiveConversationCache(maxsize=2)
+        cache.put("a", self._conv("ca"))
+        cache.put("b", self._conv("cb"))
+        cache.get("a")
+
+        cache.put("c", self._conv("cc"))
+
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNone(cache.get_by_id("cb"))
+        self.assertIsNotNone(cache.get("a"))
+
+
+class ActiveConversationTests(_DBTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.conversations = ConversationRepository(self.conn)
+
+    def test_get_active_after_create_skips_the_query(self) -> None:
+        conv = self.conversations.create("555")
+        statements: list[str] = []
+        self.conn.set_trace_callback(statements.append)
+
+        self.assertEqual(self.conversations.get_active("555").id, conv.id)
+        self.assertEqual(statements, [])
+
+    def test_cold_lookup_is_cached(self) -> None:
+        conv = self.conversations.create("555")
+        self.conn.active_conversations.discard(conv.id)
+
+        self.assertEqual(self.conversations.get_active("555").id, conv.id)
+        self.assertEqual(self.conn.active_conversations.get("555").id, conv.id)
+
+    def test_finish_drops_the_entry(self) -> None:
+        conv = self.conversations.create("555")
+
+        self.conversations.finish(conv.id, ConversationStatus.COMPLETED)
+
+        self.assertIsNone(self.conversations.get_active("555"))
+
+    def test_increment_keeps_the_cached_counter_in_step(self) -> None:
+        conv = self.conversations.create("555")
+
+        with transaction(self.conn):
+            self.conversations.increment_messages(conv.id, 2)
+
+        self.assertEqual(self.conversations.get_active("555").total_messages, 2)
+        stored = self.conn.execute(
+            "SELECT total_messages FROM conversations WHERE id = ?", (conv.id,)
+        ).fetchone()[0]
+        self.assertEqual(stored, 2)
+
+
+class DeleteByUserTests(_DBTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.incidents = IncidentRepository(self.conn)
+        for phone in ("555", "777"):
+            UserRepository(self.conn).ensure_exists(phone)
+            incident_id = self.incidents.save(_record(phone))
+            AttachmentRepository(self.conn).save(incident_id, f"{phone}.jpg", "image")
+
+    def test_deletes_only_that_users_incidents_and_attachments(self) -> None:
+        self.assertEqual(self.incidents.delete_by_user("555"), 1)
+
+        self.assertEqual(self.count("incidents"), 1)
+        self.assertEqual(self.count("incident_attachments"), 1)
+        remaining = self.conn.execute(
+            "SELECT file_path FROM incident_attachments"
+        ).fetchone()[0]
+        self.assertEqual(remaining, "777.jpg")
+
+    def test_runs_in_one_immediate_transaction(self) -> None:
+        statements: list[str] = []
+        self.conn.set_trace_callback(statements.append)
+
+        self.incidents.delete_by_user("555")
+
+        self.assertEqual(statements[0], "BEGIN IMMEDIATE")
+        self.assertEqual(statements.count("COMMIT"), 1)
+
+    def test_failure_keeps_the_attachments(self) -> None:
+        self.conn.execute(
+            "CREATE TEMP TRIGGER no_delete BEFORE DELETE ON incidents "
+            "BEGIN SELECT RAISE(ABORT, 'blocked'); END"
+        )
+
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.incidents.delete_by_user("555")
+
+        self.assertEqual(self.count("incident_attachments"), 2)
+
+    def test_detaches_conversations_that_point_at_the_incidents(self) -> None:
+        conversations = ConversationRepository(self.conn)
+        incident_id = self.incidents.get_recent_by_user("555")[0]["id"]
+        conv = conversations.create("555")
+        conversations.finish(
+            conv.id, ConversationStatus.COMPLETED, "Incidente creado", incident_id
+        )
+
+        self.incidents.delete_by_user("555")
+
+        row = self.conn.execute(
+            "SELECT status, incident_id FROM conversations WHERE id = ?", (conv.id,)
+        ).fetchone()
+        self.assertEqual(tuple(row), ("COMPLETED", None))
+
+
+class ClassifyCacheRepositoryTests(_DBTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.cache = ClassifyCacheRepository(self.conn, max_age_days=30, max_rows=3)
+
+    def _age(self, key: str, days: int) -> None:
+        self.conn.execute(
+            "UPDATE classify_cache SET created_at = datetime('now','localtime', ?) "
+            "WHERE key = ?",
+            (f"-{days} days", key),
+        )
+
+    def test_round_trip(self) -> None:
+        self.cache.put("k", {"code": "POS-001", "confidence": 0.9})
+
+        self.assertEqual(self.cache.get("k"), {"code": "POS-001", "confidence": 0.9})
+        self.assertIsNone(self.cache.get("other"))
+
+    def test_expired_entries_are_not_served(self) -> None:
+        self.cache.put("k", {"code": "POS-001"})
+        self._age("k", 31)
+
+        self.assertIsNone(self.cache.get("k"))
+
+    def test_put_prunes_expired_entries(self) -> None:
+        self.cache.put("old", {"code": "POS-001"})
+        self._age("old", 31)
+
+        self.cache.put("new", {"code": "POS-002"})
+
+        self.assertEqual(self.count("classify_cache"), 1)
+
+    def test_put_keeps_only_the_newest_rows(self) -> None:
+        for i in range(5):
+            self.cache.put(f"k{i}", {"code": f"POS-00{i}"})
+            self._age(f"k{i}", 5 - i)
+
+        self.cache.put("k5", {"code": "POS-005"})
+
+        keys = {row[0] for row in self.conn.execute("SELECT key FROM classify_cache")}
+        self.assertEqual(keys, {"k3", "k4", "k5"})
+
+    def test_replacing_an_entry_refreshes_it(self) -> None:
+        self.cache.put("k", {"code": "POS-001"})
+        self._age("k", 29)
+
+        self.cache.put("k", {"code": "POS-002"})
+
+        self.assertEqual(self.cache.get("k"), {"code": "POS-002"})
+        fresh = self.conn.execute(
+            "SELECT created_at >= datetime('now','localtime','-1 day') "
+            "FROM classify_cache WHERE key = 'k'"
+        ).fetchone()[0]
+        self.assertTrue(fresh)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,376 @@
+"""Tests for the graph nodes, state reducers and classify helpers."""
+from __future__ import annotations
+
+import json
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest import mock
+
+from langchain_core.messages import AIMessage
+from pydantic import ValidationError
+
+from src.content_safety import ContentSafetyResult
+from src.db.engine import get_connection, init_db
+from src.graph import nodes
+from src.graph.state import RESET, extend_list, merge_dicts
+from src.models import Category, IncidentRecord, IncidentRow, IncidentStatus, Severity
+
+
+class _FakeLLM:
+    """Stands in for ChatOpenAI; replies with *candidate* as classifier JSON."""
+
+    def __init__(self, candidate: dict) -> None:
+        self.candidate = candidate
+        self.calls = 0
+
+    def invoke(self, messages, *args, **kwargs) -> AIMessage:
+        self.calls += 1
+        return AIMessage(content=json.dumps({"candidate": self.candidate}))
+
+
+class ReducerTests(unittest.TestCase):
+    def test_merge_dicts_keeps_untouched_keys(self) -> None:
+        current = {"reported_by": "555", "incident_code": "POS-001"}
+
+        merged = merge_dicts(current, {"status": "OPEN"})
+
+        self.assertEqual(
+            merged, {"reported_by": "555", "incident_code": "POS-001", "status": "OPEN"}
+        )
+        self.assertNotIn("status", current)
+
+    def test_merge_dicts_reset_replaces_the_value(self) -> None:
+        current = {"reported_by": "555", "incident_code": "POS-001"}
+
+        self.assertEqual(
+            merge_dicts(current, {RESET: True, "reported_by": "777"}),
+            {"reported_by": "777"},
+        )
+
+    def test_extend_list_appends_and_resets(self) -> None:
+        self.assertEqual(extend_list([{"a": 1}], [{"b": 2}]), [{"a": 1}, {"b": 2}])
+        self.assertEqual(extend_list([{"a": 1}], [RESET]), [])
+        self.assertEqual(extend_list([{"a": 1}], [RESET, {"b": 2}]), [{"b": 2}])
+
+    def test_greeting_clears_the_previous_conversation(self) -> None:
+        previous = {
+            "current_incident": {
+                "reported_by": "555",
+                "incident_code": "IMP-001",
+                "description": "la impresora no imprime",
+            },
+            "media_attachments": [{"type": "image", "file_path": "/x.jpg"}],
+        }
+
+        update = nodes.greeting_node({"user_phone": "555", **previous})
+
+        self.assertEqual(
+            merge_dicts(previous["current_incident"], update["current_incident"]),
+            {"reported_by": "555"},
+        )
+        self.assertEqual(
+            extend_list(previous["media_attachments"], update["media_attachments"]),
+            [],
+        )
+
+
+class ParseCandidateTests(unittest.TestCase):
+    def test_bare_json(self) -> None:
+        self.assertEqual(
+            nodes._parse_candidate('{"candidate": {"code": "POS-001", "confidence": 0.9}}'),
+            {"code": "POS-001", "confidence": 0.9},
+        )
+
+    def test_fenced_json_with_prose(self) -> None:
+        reply = (
+            "Claro, aquí está:\n```json\n"
+            '{"candidate": {"code": "IMP-002", "confidence": 0.8}}\n```\nSaludos'
+        )
+
+        self.assertEqual(
+            nodes._parse_candidate(reply), {"code": "IMP-002", "confidence": 0.8}
+        )
+
+    def test_trailing_commas(self) -> None:
+        reply = '```\n{"candidate": {"code": "NET-001", "confidence": 0.7,},}\n```'
+
+        self.assertEqual(
+            nodes._parse_candidate(reply), {"code": "NET-001", "confidence": 0.7}
+        )
+
+    def test_unrecoverable_reply_is_empty(self) -> None:
+        for reply in ("", "no sé", "{not json}", '{"candidate": "POS-001"}', "[1, 2]"):
+            with self.subTest(reply=reply), self.assertLogs(nodes.logger, "WARNING"):
+                self.assertEqual(nodes._parse_candidate(reply), {})
+
+
+class ExplicitCodeTests(unittest.TestCase):
+    def test_bare_catalog_code(self) -> None:
+        for text in ("POS-001", "pos-001", "  POS001\n"):
+            with self.subTest(text=text):
+                self.assertEqual(
+                    nodes._explicit_code_candidate(text),
+                    {"code": "POS-001", "confidence": 1.0},
+                )
+
+    def test_code_inside_free_text_goes_to_the_llm(self) -> None:
+        for text in (
+            "la POS-003 no enciende",
+            "no es POS-001",
+            "código POS001",
+            "POS-001.",
+        ):
+            with self.subTest(text=text):
+                self.assertIsNone(nodes._explicit_code_candidate(text))
+
+    def test_unknown_or_malformed_codes(self) -> None:
+        for text in ("ZZZ-999", "XPOS-001", "POS-0012", "123-456", ""):
+            with self.subTest(text=text):
+                self.assertIsNone(nodes._explicit_code_candidate(text))
+
+
+class _ClassifyTestCase(unittest.TestCase):
+    """classify_node with a fake LLM, a safe verdict and a temporary app DB."""
+
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        db_path = Path(tmp.name) / "chatbot.db"
+        init_db(db_path)
+        self.conn = get_connection(db_path)
+        self.addCleanup(self.conn.close)
+
+        self.llm = _FakeLLM({"code": "IMP-001", "confidence": 0.9})
+        for target, value in (
+            ("_get_llm", lambda: self.llm),
+            ("get_thread_connection", lambda: self.conn),
+            ("check_content_safety", lambda *a: ContentSafetyResult(True, "")),
+        ):
+            patcher = mock.patch.object(nodes, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        nodes._classify_cache.clear()
+        self.addCleanup(nodes._classify_cache.clear)
+
+    def classify(self, description: str) -> dict:
+        return nodes.classify_node({"user_description": description})
+
+
+class ClassifyCacheTests(_ClassifyTestCase):
+    def test_repeated_description_skips_the_llm(self) -> None:
+        first = self.classify("La impresora NO imprime")
+        second = self.classify("  la impresora   no imprime")
+
+        self.assertEqual(self.llm.calls, 1)
+        self.assertEqual(first["current_node"], "classify_ok")
+        self.assertEqual(
+            second["current_incident"]["incident_code"],
+            first["current_incident"]["incident_code"],
+        )
+        # The cached answer is filled with the new wording
+        self.assertEqual(
+            second["current_incident"]["description"], "  la impresora   no imprime"
+        )
+
+    def test_accents_and_case_share_a_key(self) -> None:
+        self.assertEqual(
+            nodes._normalize_description("  Cámara   ROTA "),
+            nodes._normalize_description("camara rota"),
+        )
+
+    def test_low_confidence_answers_are_not_cached(self) -> None:
+        self.llm.candidate = {"code": "IMP-001", "confidence": 0.2}
+
+        self.classify("no sé")
+        self.classify("no sé")
+
+        self.assertEqual(self.llm.calls, 2)
+        self.assertEqual(nodes._classify_cache, {})
+
+    def test_unknown_codes_are_not_cached(self) -> None:
+        self.llm.candidate = {"code": "ZZZ-999", "confidence": 0.9}
+
+        result = self.classify("algo raro")
+
+        self.assertEqual(result["current_node"], "classify_failed")
+        self.assertEqual(nodes._classify_cache, {})
+
+
+class PersistedClassifyCacheTests(_ClassifyTestCase):
+    def test_survives_a_restart_and_is_promoted_in_memory(self) -> None:
+        self.classify("la impresora no imprime")
+        nodes._classify_cache.clear()  # as after a restart
+
+        result = self.classify("La impresora no imprime")
+
+        self.assertEqual(self.llm.calls, 1)
+        self.assertEqual(result["current_incident"]["incident_code"], "IMP-001")
+        self.assertIn("la impresora no imprime", nodes._classify_cache)
+
+    def test_keys_depend_on_the_catalog_version(self) -> None:
+        key = nodes._persisted_key("la impresora no imprime")
+
+        with mock.patch.object(nodes, "_CATALOG_VERSION", "edited"):
+            self.assertNotEqual(nodes._persisted_key("la impresora no imprime"), key)
+
+    def test_db_errors_fall_back_to_the_llm(self) -> None:
+        self.conn.execute("DROP TABLE classify_cache")
+
+        result = self.classify("la impresora no imprime")
+
+        self.assertEqual(result["current_node"], "classify_ok")
+        self.assertEqual(self.llm.calls, 1)
+
+
+class _CountingDict(dict):
+    """In-flight map that signals once *expected* lookups have been made."""
+
+    def __init__(self, expected: int) -> None:
+        super().__init__()
+        self.expected = expected
+        self.lookups = 0
+        self.all_looked_up = threading.Event()
+
+    def get(self, key, default=None):
+        self.lookups += 1
+        if self.lookups >= self.expected:
+            self.all_looked_up.set()
+        return super().get(key, default)
+
+
+class SingleFlightTests(_ClassifyTestCase):
+    CALLERS = 5
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.inflight = _CountingDict(self.CALLERS)
+        patcher = mock.patch.object(nodes, "_inflight", self.inflight)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # The first call holds until every caller has found it in flight
+        invoke = self.llm.invoke
+
+        def held_invoke(*args, **kwargs):
+            self.assertTrue(self.inflight.all_looked_up.wait(5))
+            return invoke(*args, **kwargs)
+
+        self.llm.invoke = held_invoke
+
+    def run_callers(self, key: str) -> list:
+        with ThreadPoolExecutor(self.CALLERS) as pool:
+            futures = [
+                pool.submit(nodes._classify_with_llm, key, "la impresora no imprime")
+                for _ in range(self.CALLERS)
+            ]
+        return futures
+
+    def test_identical_calls_share_one_llm_request(self) -> None:
+        futures = self.run_callers("la impresora no imprime")
+
+        self.assertEqual(self.llm.calls, 1)
+        self.assertEqual(
+            [f.result() for f in futures],
+            [{"code": "IMP-001", "confidence": 0.9}] * self.CALLERS,
+        )
+        self.assertEqual(self.inflight, {})
+
+    def test_failure_reaches_every_waiter(self) -> None:
+        def failing_invoke(*args, **kwargs):
+            self.assertTrue(self.inflight.all_looked_up.wait(5))
+            raise TimeoutError("openai")
+
+        self.llm.invoke = failing_invoke
+
+        futures = self.run_callers("x")
+
+        for future in futures:
+            self.assertIsInstance(future.exception(), TimeoutError)
+        self.assertEqual(self.inflight, {})
+
+    def test_different_descriptions_do_not_wait_on_each_other(self) -> None:
+        self.inflight.all_looked_up.set()
+
+        nodes._classify_with_llm("a", "a")
+        nodes._classify_with_llm("b", "b")
+
+        self.assertEqual(self.llm.calls, 2)
+
+
+class BuildRecordTests(unittest.TestCase):
+    def fields(self, **overrides) -> dict:
+        return {
+            **nodes._RECORD_DEFAULTS,
+            "incident_code": "IMP-001",
+            "incident_name": "Impresora del POS no imprime",
+            "category": "IMP",
+            "severity": "HIGH",
+            "reported_by": "555",
+            **overrides,
+        }
+
+    def test_catalog_filled_fields_build_an_incident_row(self) -> None:
+        record = nodes._build_record(self.fields())
+
+        self.assertIsInstance(record, IncidentRow)
+        self.assertIs(record.category, Category.IMP)
+        self.assertIs(record.severity, Severity.HIGH)
+        self.assertIs(record.status, IncidentStatus.OPEN)
+
+    def test_other_types_go_through_validation(self) -> None:
+        record = nodes._build_record(self.fields(severity=Severity.HIGH))
+
+        self.assertIsInstance(record, IncidentRecord)
+        self.assertIs(record.severity, Severity.HIGH)
+
+    def test_unknown_enum_values_are_rejected(self) -> None:
+        for field in ("category", "severity", "ticket_type"):
+            with self.subTest(field=field), self.assertRaises(ValidationError):
+                nodes._build_record(self.fields(**{field: "NOPE"}))
+
+    def test_missing_values_are_rejected(self) -> None:
+        with self.assertRaises(ValidationError):
+            nodes._build_record(self.fields(incident_name=None))
+
+
+class SaveNodeTests(_ClassifyTestCase):
+    def test_saves_a_catalog_filled_incident(self) -> None:
+        state = {
+            "current_incident": {
+                **nodes._RECORD_DEFAULTS,
+                "incident_code": "IMP-001",
+                "incident_name": "Impresora del POS no imprime",
+                "category": "IMP",
+                "severity": "HIGH",
+                "reported_by": "555",
+                "description": "la impresora no imprime",
+            },
+        }
+
+        result = nodes.save_node(state)
+
+        row = self.conn.execute(
+            "SELECT incident_code, category, severity, status, reported_by "
+            "FROM incidents WHERE id = ?",
+            (result["incident_id"],),
+        ).fetchone()
+        self.assertEqual(tuple(row), ("IMP-001", "IMP", "HIGH", "OPEN", "555"))
+
+    def test_invalid_incident_is_not_saved(self) -> None:
+        state = {"current_incident": {"reported_by": "555", "severity": "NOPE"}}
+
+        with self.assertLogs(nodes.logger, "ERROR"):
+            result = nodes.save_node(state)
+
+        self.assertEqual(result["current_node"], "error")
+        self.assertEqual(result["messages"][0].content, nodes._SAVE_FAILED_MSG)
+        count = self.conn.execute("SELECT count(*) FROM incidents").fetchone()[0]
+        self.assertEqual(count, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()